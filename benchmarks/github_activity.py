@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+"""
+Check of the Github latest activity shortcut against paging every comment.
+
+get_github_activity works out the latest activity of a pull request from its
+reviews, its newest review comment and the issue comments made since the
+latest activity already known. This checks, on a corpus of fake pull
+requests, that the result is the same maximum as paging through all of a
+pull request's reviews, review comments and issue comments, as review-gator
+did before. The corpus includes pull requests without reviews or comments,
+and a second --poll style run after new comments were added, which starts
+from the latest activity of the first run.
+
+Usage:
+    python benchmarks/github_activity.py [--pull-requests N] [--seed S]
+
+Exits non-zero if any latest activity differs.
+"""
+
+import argparse
+import datetime
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.realpath(__file__))), 'src'))
+
+from review_gator import review_gator  # noqa: E402
+
+START = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class FakeUser(object):
+    def __init__(self, login):
+        self.login = login
+
+
+class FakeItem(object):
+    '''A review, review comment or issue comment.'''
+
+    def __init__(self, created_at, state=None):
+        self.created_at = created_at
+        self.submitted_at = created_at
+        self.updated_at = created_at
+        self.state = state
+        self.html_url = 'https://github.com/o/r/pull/1#item'
+        self.user = FakeUser('reviewer-{}'.format(random.randint(0, 3)))
+
+
+class FakePullRequest(object):
+    '''The parts of a PyGithub PullRequest used by get_github_activity.
+
+    Requests, i.e. pages of 100 items, are counted in requests.'''
+
+    def __init__(self, created_at):
+        self.created_at = created_at
+        self.reviews = []
+        self.review_comments = []
+        self.issue_comments = []
+        self.requests = 0
+
+    @property
+    def updated_at(self):
+        return max([self.created_at] + [
+            item.created_at for item in
+            self.reviews + self.review_comments + self.issue_comments])
+
+    def page(self, items):
+        self.requests += max(1, (len(items) + 99) // 100)
+        return list(items)
+
+    def get_reviews(self):
+        return self.page(self.reviews)
+
+    def get_review_comments(self, sort=None, direction=None, since=None):
+        items = [item for item in self.review_comments
+                 if since is None or item.updated_at >= since]
+        items.sort(key=lambda item: item.created_at,
+                   reverse=direction == 'desc')
+        # Only the first page is used by get_github_activity
+        self.requests += 1
+        return items
+
+    def get_issue_comments_since(self, since):
+        return self.page([item for item in self.issue_comments
+                          if item.updated_at >= since])
+
+
+def add_activity(pull_request, after, count):
+    for _ in range(count):
+        created_at = after + datetime.timedelta(
+            minutes=random.randint(1, 60 * 24 * 30))
+        kind = random.choice(['review', 'review_comment', 'issue_comment'])
+        if kind == 'review':
+            pull_request.reviews.append(FakeItem(
+                created_at, random.choice(
+                    ['APPROVED', 'COMMENTED', 'CHANGES_REQUESTED',
+                     'PENDING'])))
+        elif kind == 'review_comment':
+            pull_request.review_comments.append(FakeItem(created_at))
+        else:
+            pull_request.issue_comments.append(FakeItem(created_at))
+
+
+def get_latest_activity_by_paging(pull_request):
+    '''The latest activity as found by paging every item.'''
+    latest_activity = pull_request.created_at
+    for item in pull_request.issue_comments + pull_request.review_comments:
+        latest_activity = max(latest_activity, item.created_at)
+    for review in pull_request.reviews:
+        if review.state != 'PENDING':
+            latest_activity = max(latest_activity, review.submitted_at)
+    return latest_activity
+
+
+def check(pull_requests, since):
+    '''Return the pull requests whose latest activity differs, and the
+    requests get_github_activity made for them.'''
+    differences = []
+    requests = 0
+    for pull_request, pr_since in zip(pull_requests, since):
+        pull_request.requests = 0
+        _reviews, latest_activity = review_gator.get_github_activity(
+            pull_request, pr_since)
+        requests += pull_request.requests
+        if latest_activity != get_latest_activity_by_paging(pull_request):
+            differences.append(pull_request)
+    return differences, requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--pull-requests', type=int, default=500,
+                        help='Number of fake pull requests [default: 500]')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the fake corpus [default: 0]')
+    args = parser.parse_args()
+    random.seed(args.seed)
+    review_gator.get_github_comments_since = \
+        lambda p, since: p.get_issue_comments_since(since)
+
+    pull_requests = []
+    for index in range(args.pull_requests):
+        pull_request = FakePullRequest(START + datetime.timedelta(
+            hours=random.randint(0, 24 * 365)))
+        # Some without any reviews or comments, some with several pages
+        add_activity(pull_request, pull_request.created_at,
+                     random.choice([0, 0, 1, 3, 10, 50, 250]))
+        pull_requests.append(pull_request)
+
+    failed = False
+    differences, requests = check(
+        pull_requests, [pr.created_at for pr in pull_requests])
+    print('first run: {} pull requests, {} requests, {} differences'.format(
+        len(pull_requests), requests, len(differences)))
+    failed = failed or bool(differences)
+
+    # As in --poll mode, pull requests updated since start from the latest
+    # activity of the previous run
+    since = [review_gator.get_github_activity(pr, pr.created_at)[1]
+             for pr in pull_requests]
+    for pull_request in pull_requests:
+        if random.random() < 0.5:
+            add_activity(pull_request, pull_request.updated_at,
+                         random.randint(1, 5))
+    differences, requests = check(pull_requests, since)
+    print('second run: {} pull requests, {} requests, {} differences'.format(
+        len(pull_requests), requests, len(differences)))
+    failed = failed or bool(differences)
+    if failed:
+        print('FAIL: latest activity differs from paging every item')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
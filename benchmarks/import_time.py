@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+Import-time benchmark for the review-gator CLI module.
+
+Importing review_gator.review_gator must stay cheap because review-gator is
+run from cron for many teams. The backend libraries (PyGithub, launchpadlib,
+GitPython, joblib, ...) are imported on first use by the backend that needs
+them, so they must not be pulled in at module load.
+
+Usage:
+    python benchmarks/import_time.py [--repeat N] [--max-ms MS]
+
+Exits non-zero if a heavy module is imported at module load or if the median
+import time exceeds --max-ms.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# Modules that must only be imported when a backend actually needs them
+HEAVY_MODULES = [
+    'babel',
+    'git',
+    'github',
+    'humanize',
+    'jinja2',
+    'joblib',
+    'launchpadlib',
+    'lazr.restfulclient',
+    'lpmptox',
+    'lpshipit',
+]
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+import review_gator.review_gator
+elapsed = (time.perf_counter() - start) * 1000
+heavy = {heavy!r}
+loaded = [m for m in heavy if m in sys.modules]
+print('{{:.3f}}'.format(elapsed))
+print(','.join(loaded))
+"""
+
+
+def run_probe():
+    src_dir = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.realpath(__file__))), 'src')
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [src_dir] + [p for p in [env.get('PYTHONPATH')] if p])
+    output = subprocess.check_output(
+        [sys.executable, '-c', PROBE.format(heavy=HEAVY_MODULES)],
+        env=env, universal_newlines=True)
+    elapsed, loaded = output.splitlines()[-2:]
+    return float(elapsed), [m for m in loaded.split(',') if m]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of cold imports to time [default: 5]')
+    parser.add_argument('--max-ms', type=float, default=None,
+                        help='Fail if the median import time exceeds this')
+    args = parser.parse_args()
+
+    timings = []
+    loaded = []
+    for _ in range(args.repeat):
+        elapsed, loaded = run_probe()
+        timings.append(elapsed)
+    median = statistics.median(timings)
+    print('import review_gator.review_gator: median {:.1f}ms '
+          '(min {:.1f}ms, max {:.1f}ms, {} runs)'.format(
+              median, min(timings), max(timings), len(timings)))
+
+    failed = False
+    if loaded:
+        print('FAIL: heavy modules imported at module load: {}'.format(
+            ', '.join(loaded)))
+        failed = True
+    if args.max_ms is not None and median > args.max_ms:
+        print('FAIL: median import time {:.1f}ms exceeds {:.1f}ms'.format(
+            median, args.max_ms))
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,196 @@
+"""
+Bounded store for the tox artifacts written to the output directory.
+
+For each merge proposal tox is run for, the output directory holds:
+
+* ``<mp_id>.svg``: the tox state badge
+* ``tox-<mp_id>.output.txt``: the tox output while tox is running
+* ``tox-<mp_id>.output.txt.gz``: the compressed tox output once it finished
+* ``tox-<mp_id>.summary.txt``: a short summary of the result
+* ``tox-<mp_id>.status.json``: the state of the tox run, followed by the page
+
+prune() removes the artifacts of merge proposals no longer in the queue and
+any older than the maximum age, then the oldest compressed outputs until the
+artifacts fit in the maximum total size.
+"""
+
+import collections
+import gzip
+import json
+import os
+import re
+import shutil
+
+DEFAULT_MAX_AGE_DAYS = 14
+DEFAULT_MAX_TOTAL_MB = 200
+# Lines of the end of the tox output included in a summary
+SUMMARY_TAIL_LINES = 20
+# Most lines reporting tox environment results included in a summary
+SUMMARY_RESULT_LINES = 20
+# Lines reporting tox environment results, for tox 3 and tox 4
+RESULT_LINE_RE = re.compile(
+    r'commands (failed|succeeded)|: (OK|FAIL)\b|evaluation failed|'
+    r'congratulations|InvocationError|^ERROR:')
+ARTIFACT_RE = re.compile(
+    r'^(?:(?P<badge_id>\d+)\.svg|'
+    r'tox-(?P<output_id>\d+)\.'
+    r'(?:output\.txt(?:\.gz)?|summary\.txt|status\.json))$')
+
+_settings = {
+    'max_age_days': DEFAULT_MAX_AGE_DAYS,
+    'max_total_mb': DEFAULT_MAX_TOTAL_MB,
+}
+
+
+def configure(max_age_days=None, max_total_mb=None):
+    '''Set the retention limits used by prune.'''
+    if max_age_days is not None:
+        _settings['max_age_days'] = max_age_days
+    if max_total_mb is not None:
+        _settings['max_total_mb'] = max_total_mb
+
+
+def get_badge_filepath(output_directory, mp_id):
+    return os.path.join(output_directory, "{}.svg".format(mp_id))
+
+
+def get_output_filepath(output_directory, mp_id):
+    return os.path.join(output_directory, "tox-{}.output.txt".format(mp_id))
+
+
+def get_compressed_output_filepath(output_directory, mp_id):
+    return '{}.gz'.format(get_output_filepath(output_directory, mp_id))
+
+
+def get_summary_filepath(output_directory, mp_id):
+    return os.path.join(output_directory, "tox-{}.summary.txt".format(mp_id))
+
+
+def get_status_filepath(output_directory, mp_id):
+    return os.path.join(output_directory, "tox-{}.status.json".format(mp_id))
+
+
+def write_status(output_directory, mp_id, status):
+    '''Replace the status file of a tox run with status.
+
+    The file is replaced atomically so the page never reads a partial one.'''
+    status_filepath = get_status_filepath(output_directory, mp_id)
+    with open('{}.tmp'.format(status_filepath), 'w') as status_file:
+        json.dump(status, status_file)
+    os.replace('{}.tmp'.format(status_filepath), status_filepath)
+
+
+def get_filepaths(output_directory, mp_id):
+    '''Return the paths of every artifact of a merge proposal.'''
+    return [get_badge_filepath(output_directory, mp_id),
+            get_output_filepath(output_directory, mp_id),
+            get_compressed_output_filepath(output_directory, mp_id),
+            get_summary_filepath(output_directory, mp_id),
+            get_status_filepath(output_directory, mp_id)]
+
+
+def link(source_directory, output_directory, mp_id):
+    '''Link the artifacts of a merge proposal from source_directory.
+
+    Used when several reports show the merge proposal but tox only runs for
+    it in one of their output directories. The links are relative and made
+    for artifacts yet to be written too.'''
+    os.makedirs(output_directory, exist_ok=True)
+    for source, filepath in zip(get_filepaths(source_directory, mp_id),
+                                get_filepaths(output_directory, mp_id)):
+        target = os.path.relpath(source, output_directory)
+        if os.path.islink(filepath) and os.readlink(filepath) == target:
+            continue
+        if os.path.lexists(filepath):
+            os.remove(filepath)
+        os.symlink(target, filepath)
+
+
+def remove_links(output_directory, mp_id):
+    '''Remove the artifacts of a merge proposal that are links.'''
+    for filepath in get_filepaths(output_directory, mp_id):
+        if os.path.islink(filepath):
+            os.remove(filepath)
+
+
+def summarize(output_filepath, return_code):
+    '''Return a short summary of the tox output in output_filepath.
+
+    The output is read line by line, keeping only the lines reporting tox
+    environment results and the last lines, so large logs are never held in
+    memory.'''
+    result_lines = []
+    tail = collections.deque(maxlen=SUMMARY_TAIL_LINES)
+    with open(output_filepath, errors='replace') as output_file:
+        for line in output_file:
+            line = line.rstrip('\n')
+            tail.append(line)
+            if (RESULT_LINE_RE.search(line) and
+                    len(result_lines) < SUMMARY_RESULT_LINES):
+                result_lines.append(line)
+    summary = ['Tox {} (exit code {})'.format(
+        'PASSED' if return_code == 0 else 'FAILED', return_code), '']
+    if result_lines:
+        summary.extend(['Results:'] + result_lines + [''])
+    summary.extend(['Last {} lines:'.format(len(tail))] + list(tail))
+    summary.extend(['', 'Full output: {}.gz'.format(
+        os.path.basename(output_filepath))])
+    return '\n'.join(summary) + '\n'
+
+
+def finish(output_directory, mp_id, return_code):
+    '''Write the summary of a finished tox run and compress its output.'''
+    output_filepath = get_output_filepath(output_directory, mp_id)
+    if not os.path.exists(output_filepath):
+        return
+    summary_filepath = get_summary_filepath(output_directory, mp_id)
+    with open(summary_filepath, 'w') as summary_file:
+        summary_file.write(summarize(output_filepath, return_code))
+    compressed_filepath = get_compressed_output_filepath(
+        output_directory, mp_id)
+    with open(output_filepath, 'rb') as output_file, \
+            gzip.open(compressed_filepath, 'wb') as compressed_file:
+        shutil.copyfileobj(output_file, compressed_file)
+    os.remove(output_filepath)
+
+
+def prune(output_directory, active_mp_ids, now):
+    '''Remove tox artifacts beyond the retention limits.
+
+    Artifacts of merge proposals not in active_mp_ids, and any artifact not
+    modified for the maximum age, are removed. Then the oldest compressed
+    outputs are removed until all artifacts fit in the maximum total size.
+    now is a POSIX timestamp. Returns the number of files removed.'''
+    if not os.path.isdir(output_directory):
+        return 0
+    max_age = _settings['max_age_days'] * 24 * 60 * 60
+    max_total_bytes = _settings['max_total_mb'] * 1024 * 1024
+    removed = 0
+    kept = []
+    for filename in os.listdir(output_directory):
+        match = ARTIFACT_RE.match(filename)
+        if match is None:
+            continue
+        mp_id = match.group('badge_id') or match.group('output_id')
+        filepath = os.path.join(output_directory, filename)
+        try:
+            # Artifacts linked from another output directory count as links
+            stat = os.lstat(filepath)
+        except OSError:
+            continue
+        if mp_id not in active_mp_ids or now - stat.st_mtime > max_age:
+            os.remove(filepath)
+            removed += 1
+        else:
+            kept.append((stat.st_mtime, stat.st_size, filepath))
+
+    total_bytes = sum(size for _mtime, size, _filepath in kept)
+    for _mtime, size, filepath in sorted(kept):
+        if total_bytes <= max_total_bytes:
+            break
+        if not filepath.endswith('.gz'):
+            continue
+        os.remove(filepath)
+        removed += 1
+        total_bytes -= size
+    return removed
@@ -0,0 +1,235 @@
+"""
+Pool of Github tokens sharing the requests of a sweep.
+
+An org-wide config easily uses up the hourly quota of a single token. With
+several personal access tokens each request is authenticated with the token
+that has the most requests left, as reported by the X-RateLimit headers of
+its last response, so the quotas are used evenly. A token whose quota is
+not known yet, which other clients may have used up, is tried by one
+request at a time.
+
+A request refused by the primary rate limit of its token is issued again
+with another token, instead of waiting for the reset as GithubRetry does.
+A token with no requests left is not used again until its quota is reset,
+and once every token is exhausted requests wait for the first reset instead
+of failing.
+"""
+
+import threading
+import time
+import weakref
+
+from github.Auth import Auth
+from github.Consts import (
+    headerRateLimit,
+    headerRateRemaining,
+    headerRateReset,
+)
+from github.GithubRetry import GithubRetry
+from github.Requester import WithRequester
+from urllib3.exceptions import MaxRetryError
+
+# Longest wait, in seconds, for an exhausted pool to be reset
+MAX_WAIT = 60 * 60
+# Wait, in seconds, when exhausted tokens did not tell when they are reset
+RETRY_WAIT = 60
+# Statuses of the responses refused by a rate limit
+RATE_LIMIT_STATUSES = (403, 429)
+
+# Every pool in use, for report()
+_pools = weakref.WeakSet()
+
+
+def mask(token):
+    return '...{}'.format(token[-4:])
+
+
+def is_rate_limited(status, headers):
+    '''Return whether a response was refused by the primary rate limit of
+    its token.'''
+    return (status in RATE_LIMIT_STATUSES
+            and headers.get(headerRateRemaining) == '0')
+
+
+class PoolRetry(GithubRetry):
+    '''GithubRetry returning the responses refused by a primary rate limit,
+    for the pool to issue them again with another token.'''
+
+    def increment(self, method=None, url=None, response=None, error=None,
+                  _pool=None, _stacktrace=None):
+        if response is not None and is_rate_limited(response.status,
+                                                    response.headers):
+            # Returned as is by urllib3, as raise_on_status is False
+            raise MaxRetryError(_pool, url, 'primary rate limit exceeded')
+        return super(PoolRetry, self).increment(
+            method=method, url=url, response=response, error=error,
+            _pool=_pool, _stacktrace=_stacktrace)
+
+
+class TokenQuota(object):
+    '''The requests left to a token, None while not known.'''
+
+    def __init__(self, token):
+        self.token = token
+        self.remaining = None
+        self.limit = None
+        # POSIX timestamp
+        self.reset = None
+        self.requests = 0
+        # Whether a request is trying the token while its quota is not known
+        self.probing = False
+
+    def available(self, now):
+        if self.reset is not None and now >= self.reset:
+            # The quota was reset since the last response
+            self.remaining = None
+            self.reset = None
+        return self.remaining is None or self.remaining > 0
+
+    def __repr__(self):
+        return '{}: {} requests, {} of {} left'.format(
+            mask(self.token), self.requests,
+            '?' if self.remaining is None else self.remaining,
+            '?' if self.limit is None else self.limit)
+
+
+class TokenPool(Auth, WithRequester):
+    '''PyGithub authentication spreading requests over several tokens.'''
+
+    def __init__(self, tokens):
+        Auth.__init__(self)
+        WithRequester.__init__(self)
+        self.quotas = {token: TokenQuota(token) for token in tokens}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        _pools.add(self)
+
+    @property
+    def token_type(self):
+        return 'token'
+
+    @property
+    def token(self):
+        '''The token of this thread's last request.'''
+        return getattr(self._local, 'token', None)
+
+    @property
+    def _masked_token(self):
+        return 'token (removed)'
+
+    def acquire(self):
+        '''Return the token with the most requests left, waiting for a
+        reset if every token is exhausted.'''
+        warned = False
+        while True:
+            with self._lock:
+                now = time.time()
+                available = [quota for quota in self.quotas.values()
+                             if quota.available(now)]
+                unknown = [quota for quota in available
+                           if quota.remaining is None and not quota.probing]
+                known = [quota for quota in available
+                         if quota.remaining is not None]
+                if unknown:
+                    quota = unknown[0]
+                    quota.probing = True
+                elif known:
+                    quota = max(known, key=lambda quota: quota.remaining)
+                    # Until its response tells, for concurrent requests
+                    quota.remaining -= 1
+                elif available:
+                    # Only tokens being tried, while the first responses
+                    # are awaited
+                    quota = min(available, key=lambda quota: quota.requests)
+                if available:
+                    quota.requests += 1
+                    return quota.token
+                resets = [quota.reset for quota in self.quotas.values()
+                          if quota.reset is not None]
+                wait = min(resets) - now if resets else RETRY_WAIT
+            if not warned:
+                print('** All {} Github tokens are rate limited, waiting '
+                      '{:.0f}s for the first to be reset **'.format(
+                          len(self.quotas), wait))
+                warned = True
+            time.sleep(min(max(wait, 1), MAX_WAIT))
+
+    def authentication(self, headers):
+        self._local.token = self.acquire()
+        super(TokenPool, self).authentication(headers)
+
+    def observe(self, authorization, status, headers):
+        '''Update the quota of the token authorization from the rate limit
+        headers of its response, an empty dict if it failed.
+
+        Return whether the response was refused by the primary rate limit of
+        the token, which is then exhausted until its reset.'''
+        limited = is_rate_limited(status, headers)
+        token = (authorization or '').rpartition(' ')[2]
+        quota = self.quotas.get(token)
+        if quota is None:
+            return limited
+        with self._lock:
+            quota.probing = False
+            if headerRateRemaining not in headers:
+                return limited
+            quota.remaining = int(float(headers[headerRateRemaining]))
+            if headerRateLimit in headers:
+                quota.limit = int(float(headers[headerRateLimit]))
+            if headerRateReset in headers:
+                quota.reset = int(float(headers[headerRateReset]))
+        return limited
+
+    def withRequester(self, requester):
+        '''Observe the responses of every requester using the pool.
+
+        Requesters read their connection class once created, so the class
+        installed by the recorder, if any, is kept.'''
+        super(TokenPool, self).withRequester(requester)
+        pool = self
+        attribute = '_Requester__connectionClass'
+        base = getattr(requester, attribute)
+
+        class ObservedConnection(base):
+            def getresponse(self):
+                # Each token is tried once more at most, past that the
+                # rate limited response is returned
+                for _attempt in range(len(pool.quotas)):
+                    response, limited = self.observed_response()
+                    if not limited:
+                        return response
+                    # The exhausted token is replaced in the headers the
+                    # request is issued with
+                    pool.authentication(self.headers)
+                return self.observed_response()[0]
+
+            def observed_response(self):
+                '''Return the response of the request and whether it was
+                refused by the rate limit of its token.'''
+                authorization = self.headers.get('Authorization')
+                try:
+                    response = super(ObservedConnection, self).getresponse()
+                except Exception:
+                    pool.observe(authorization, None, {})
+                    raise
+                return response, pool.observe(
+                    authorization, response.status,
+                    {name.lower(): value
+                     for name, value in response.getheaders()})
+
+        setattr(requester, attribute, ObservedConnection)
+        return self
+
+    def report(self):
+        '''Return a summary of the use of each token since the last
+        report.'''
+        with self._lock:
+            summary = ', '.join(repr(quota) for quota in self.quotas.values())
+            for quota in self.quotas.values():
+                quota.requests = 0
+        return 'github tokens: {}'.format(summary)
+
+
+def report():
+    '''Return a summary of the use of the tokens of every pool.'''
+    return '\n'.join(pool.report() for pool in list(_pools))
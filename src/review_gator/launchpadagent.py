@@ -53,10 +53,24 @@ class AuthorizeRequestTokenWithConsole(RequestTokenAuthorizationEngine):
                     raise e
 
 
-def get_launchpad(launchpadlib_dir=None, lp_credentials_store=None):
+def get_launchpad(launchpadlib_dir=None, lp_credentials_store=None,
+                  timeout=None):
     """ return a launchpad API class. In case launchpadlib_dir is
     specified used that directory to store launchpadlib cache instead of
-    the default """
+    the default. timeout is the socket timeout in seconds for each request
+    """
+    from . import recorder
+    recorder.install_launchpad()
+    lp_app = 'review-gator'
+    lp_env = 'production'
+    lp_version = 'devel'
+    store = recorder.get_store()
+    if store is not None and store.replaying:
+        # Replayed traffic needs no credentials
+        return Launchpad.login_anonymously(lp_app, lp_env,
+                                           launchpadlib_dir=launchpadlib_dir,
+                                           timeout=timeout,
+                                           version=lp_version)
     if not lp_credentials_store:
         creds_prefix = os.environ.get('SNAP_USER_COMMON',
                                       os.path.expanduser('~'))
@@ -64,13 +78,11 @@ def get_launchpad(launchpadlib_dir=None, lp_credentials_store=None):
                 os.path.join(creds_prefix, '.launchpad.credentials'))
     else:
         store = UnencryptedFileCredentialStore(lp_credentials_store)
-    lp_app = 'review-gator'
-    lp_env = 'production'
-    lp_version = 'devel'
 
     authorization_engine = AuthorizeRequestTokenWithConsole(lp_env, lp_app)
     return Launchpad.login_with(lp_app, lp_env,
                                 credential_store=store,
                                 authorization_engine=authorization_engine,
                                 launchpadlib_dir=launchpadlib_dir,
+                                timeout=timeout,
                                 version=lp_version)
@@ -0,0 +1,187 @@
+"""
+Bounded, process-safe cache of Launchpad responses.
+
+launchpadlib keeps every response it may revalidate later in a directory,
+one file per response, and never removes any. The cache installed here keeps
+launchpadlib's atomic writes and adds:
+
+* eviction of entries not used for the maximum age, and of the least
+  recently used entries once the cache is larger than the maximum size
+* an exclusive lock around writes and eviction, so several review-gator
+  processes can share the cache directory
+* hit and miss counts, reported after each run
+"""
+
+import fcntl
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from lazr.restfulclient._browser import MultipleRepresentationCache
+
+LOCK_FILENAME = '.review-gator.lock'
+# Fraction of the maximum size written between evictions
+EVICTION_INTERVAL = 0.1
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0}
+
+
+def count(name, value=1):
+    with _stats_lock:
+        _stats[name] += value
+
+
+def report():
+    '''Return a summary of the cache use since the last report.'''
+    with _stats_lock:
+        stats = dict(_stats)
+        for name in _stats:
+            _stats[name] = 0
+    lookups = stats['hits'] + stats['misses']
+    return ('launchpad cache: {} hits, {} misses ({:.0%} hit rate), '
+            '{} expired, {} evicted'.format(
+                stats['hits'], stats['misses'],
+                stats['hits'] / lookups if lookups else 0,
+                stats['expired'], stats['evicted']))
+
+
+class BoundedCache(MultipleRepresentationCache):
+    '''A launchpadlib cache bounded in age and size.'''
+
+    def __init__(self, cache, max_age, max_bytes):
+        super(BoundedCache, self).__init__(cache)
+        # Seconds and bytes
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self._written = 0
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def _locked(self):
+        '''Hold the cache directory lock shared by all processes.'''
+        lock_path = os.path.join(self._cache_dir, LOCK_FILENAME)
+        with open(lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _count_lookup(self, name):
+        if not getattr(self._local, 'uncounted', False):
+            count(name)
+
+    def _getCachedHeader(self, uri, header):
+        # lazr looks a request up for its ETag before httplib2 looks it up
+        # again, so only httplib2's lookup is counted as a hit or miss
+        self._local.uncounted = True
+        try:
+            return super(BoundedCache, self)._getCachedHeader(uri, header)
+        finally:
+            self._local.uncounted = False
+
+    def get(self, key):
+        path = self._get_key_path(key)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            self._count_lookup('misses')
+            return None
+        if time.time() - mtime > self.max_age:
+            count('expired')
+            self._count_lookup('misses')
+            with self._locked():
+                # Unless another process has just written it again
+                if remove_older(path, time.time() - self.max_age):
+                    count('evicted')
+            return None
+        value = super(BoundedCache, self).get(key)
+        if value is None:
+            self._count_lookup('misses')
+            return None
+        self._count_lookup('hits')
+        try:
+            # Mark the entry as recently used for eviction
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def set(self, key, value):
+        with self._locked():
+            super(BoundedCache, self).set(key, value)
+        with self._write_lock:
+            self._written += len(value)
+            evict = self._written > self.max_bytes * EVICTION_INTERVAL
+            if evict:
+                self._written = 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        '''Remove expired entries, then the least recently used ones until
+        the cache fits in its maximum size. Returns the entries removed.'''
+        removed = 0
+        with self._locked():
+            now = time.time()
+            entries = []
+            for filename in os.listdir(self._cache_dir):
+                if filename == LOCK_FILENAME:
+                    continue
+                path = os.path.join(self._cache_dir, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if filename.startswith(self.TEMPFILE_PREFIX):
+                    # Left over by an interrupted write, unless still being
+                    # written by another process
+                    if now - stat.st_mtime > 60 * 60:
+                        removed += remove(path)
+                    continue
+                if now - stat.st_mtime > self.max_age:
+                    removed += remove(path)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, path))
+            total_bytes = sum(size for _mtime, size, _path in entries)
+            for _mtime, size, path in sorted(entries):
+                if total_bytes <= self.max_bytes:
+                    break
+                removed += remove(path)
+                total_bytes -= size
+        count('evicted', removed)
+        return removed
+
+
+def remove(path):
+    '''Remove path, returning 1 if it was removed by this call.'''
+    try:
+        os.remove(path)
+    except OSError:
+        return 0
+    return 1
+
+
+def remove_older(path, cutoff):
+    '''Remove path if it was last modified before cutoff.'''
+    try:
+        if os.stat(path).st_mtime >= cutoff:
+            return 0
+    except OSError:
+        return 0
+    return remove(path)
+
+
+def install(lp, max_size_mb, max_age_days):
+    '''Replace the response cache of the Launchpad client lp by a
+    BoundedCache of the same directory.'''
+    connection = lp._browser._connection
+    cache = BoundedCache(connection.cache._cache_dir,
+                         max_age_days * 24 * 60 * 60,
+                         max_size_mb * 1024 * 1024)
+    cache.evict()
+    connection.cache = cache
+    return cache
@@ -0,0 +1,160 @@
+"""
+Profile a review-gator sweep.
+
+With --profile the first sweep runs under cProfile. Sources are collected in
+worker threads (see collect_source). From Python 3.12 cProfile is built on
+sys.monitoring, which follows every thread and allows a single profiler, so
+the sweep's profiler covers them. Before that cProfile does not follow
+threads, so each worker started through call() is profiled on its own and
+the results are merged. Two files are written to the output directory:
+
+* ``profile.pstats``: the merged stats, readable with pstats, snakeviz, or
+  converted to a flamegraph with flameprof or gprof2dot
+* ``profile-summary.txt``: the time spent in each phase of the sweep, the
+  hottest functions called by each phase and the hottest functions overall
+"""
+
+import io
+import os
+import sys
+import threading
+
+STATS_FILENAME = 'profile.pstats'
+SUMMARY_FILENAME = 'profile-summary.txt'
+# Functions listed overall, and below each phase function
+HOTTEST_FUNCTIONS = 25
+HOTTEST_CALLEES = 10
+# Whether the profiler of the sweep also profiles its threads
+PROFILER_FOLLOWS_THREADS = sys.version_info >= (3, 12)
+# The phases of a sweep, as (name, [(file suffix, function name)]). The
+# cumulative time of the functions of a phase is attributed to it.
+PHASES = [
+    ('github collection', [('review_gator.py', 'get_prs')]),
+    ('launchpad collection', [('review_gator.py', 'get_mps')]),
+    ('rendering', [('review_gator.py', 'render')]),
+    ('tox scheduling', [('artifacts.py', 'prune'),
+                        ('tox_runner.py', 'run_tox'),
+                        ('joblib/parallel.py', '__call__')]),
+]
+
+_worker_profiles = None
+_worker_lock = threading.Lock()
+_running_workers = [0]
+
+
+def call(func, *args, **kwargs):
+    '''Call func, profiled when a sweep is being profiled.
+
+    Use this for functions run in a thread of their own.'''
+    if _worker_profiles is None or PROFILER_FOLLOWS_THREADS:
+        return func(*args, **kwargs)
+    # deferred import of cProfile until required
+    import cProfile
+    profile = cProfile.Profile()
+    with _worker_lock:
+        _running_workers[0] += 1
+    profile.enable()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profile.disable()
+        with _worker_lock:
+            _running_workers[0] -= 1
+            if _worker_profiles is not None:
+                _worker_profiles.append(profile)
+
+
+def run(func, output_directory, *args, **kwargs):
+    '''Call func under cProfile and write the profile to output_directory.'''
+    global _worker_profiles
+    # deferred import of cProfile until required
+    import cProfile
+    _worker_profiles = []
+    _running_workers[0] = 0
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profile.disable()
+        with _worker_lock:
+            worker_profiles = _worker_profiles
+            running_workers = _running_workers[0]
+            _worker_profiles = None
+        write(output_directory, [profile] + worker_profiles, running_workers)
+
+
+def write(output_directory, profiles, running_workers=0):
+    # deferred import of pstats until required
+    import pstats
+    stats = pstats.Stats(profiles[0])
+    for profile in profiles[1:]:
+        stats.add(profile)
+    os.makedirs(output_directory, exist_ok=True)
+    stats_filepath = os.path.join(output_directory, STATS_FILENAME)
+    stats.dump_stats(stats_filepath)
+    summary_filepath = os.path.join(output_directory, SUMMARY_FILENAME)
+    with open(summary_filepath, 'w') as summary_file:
+        summary_file.write(summarize(stats, len(profiles), running_workers))
+    print('Profile written to {} and {}'.format(
+        stats_filepath, summary_filepath))
+
+
+def get_function_name(key):
+    filename, line, name = key
+    return '{}:{}({})'.format(os.path.basename(filename), line, name)
+
+
+def get_phase_functions(stats, functions):
+    return [key for key in stats.stats
+            if any(key[0].endswith(suffix) and key[2] == name
+                   for suffix, name in functions)]
+
+
+def get_callees(stats, caller):
+    '''Return [(cumulative time, calls, function)] called by caller.'''
+    callees = []
+    for key, (_cc, _nc, _tt, _ct, callers) in stats.stats.items():
+        if caller in callers:
+            _cc, nc, _tt, ct = callers[caller]
+            callees.append((ct, nc, key))
+    return sorted(callees, reverse=True)
+
+
+def summarize(stats, thread_count=1, running_workers=0):
+    '''Return a text summary of where the time of the sweep went.'''
+    # Time spent in each thread is summed, so the total exceeds the wall
+    # clock time when sources are collected concurrently
+    if PROFILER_FOLLOWS_THREADS:
+        lines = ['Profile of one review-gator sweep, {:.3f}s in all threads.'
+                 .format(stats.total_tt)]
+    else:
+        lines = ['Profile of one review-gator sweep, {:.3f}s in {} thread(s).'
+                 .format(stats.total_tt, thread_count)]
+    if running_workers:
+        lines.append('{} collection worker(s) still running past their '
+                     'deadline are not included.'.format(running_workers))
+    lines.extend(['', 'Time per phase (cumulative seconds, calls):'])
+    phase_functions = {}
+    for phase, functions in PHASES:
+        keys = get_phase_functions(stats, functions)
+        phase_functions[phase] = keys
+        lines.append('  {:<22} {:>10.3f}s {:>8}'.format(
+            phase,
+            sum(stats.stats[key][3] for key in keys),
+            sum(stats.stats[key][1] for key in keys)))
+
+    for phase, _functions in PHASES:
+        for key in phase_functions[phase]:
+            lines.extend(['', 'Hottest callees of {} ({}):'.format(
+                get_function_name(key), phase)])
+            for ct, nc, callee in get_callees(stats, key)[:HOTTEST_CALLEES]:
+                lines.append('  {:>10.3f}s {:>8}  {}'.format(
+                    ct, nc, get_function_name(callee)))
+
+    output = io.StringIO()
+    stats.stream = output
+    stats.sort_stats('cumulative').print_stats(HOTTEST_FUNCTIONS)
+    stats.sort_stats('time').print_stats(HOTTEST_FUNCTIONS)
+    lines.extend(['', 'Hottest functions:', output.getvalue()])
+    return '\n'.join(lines)
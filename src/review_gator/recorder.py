@@ -0,0 +1,249 @@
+"""
+Record and replay the network traffic of a review-gator sweep.
+
+When recording, every HTTP response seen by PyGithub and launchpadlib, and
+the head commit date found by the git clone step, is written to a directory.
+When replaying, the same sweep is served entirely from that directory so
+collection strategies can be compared reproducibly and without network
+access or rate limit.
+
+Interactions are stored one per file as
+``<directory>/<backend>/<key hash>-<n>.json`` where ``n`` counts repeated
+requests for the same key. Request headers (and so credentials) are never
+stored.
+"""
+
+import base64
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import time
+
+BACKENDS = ['github', 'launchpad', 'git']
+META_FILENAME = 'meta.json'
+RECORDING_VERSION = 1
+
+_STORE = None
+# Originals of anything patched by install_github/install_launchpad
+_patched = {}
+
+
+class ReplayMissError(Exception):
+    """Raised when replaying a request that was never recorded."""
+
+
+class TrafficStore(object):
+    """A directory of recorded interactions."""
+
+    def __init__(self, directory, replaying=False, latency=0.0, now=None):
+        self.directory = directory
+        self.replaying = replaying
+        # Injected latency in seconds for every replayed interaction
+        self.latency = latency
+        self.now = now
+        self._counters = {}
+        if replaying:
+            self._load_meta()
+        else:
+            self._prepare()
+
+    def _prepare(self):
+        for backend in BACKENDS:
+            shutil.rmtree(os.path.join(self.directory, backend), True)
+            os.makedirs(os.path.join(self.directory, backend), exist_ok=True)
+        with open(os.path.join(self.directory, META_FILENAME), 'w') as meta:
+            json.dump({'version': RECORDING_VERSION,
+                       'now': self.now.isoformat() if self.now else None},
+                      meta)
+
+    def _load_meta(self):
+        meta_filepath = os.path.join(self.directory, META_FILENAME)
+        if not os.path.exists(meta_filepath):
+            raise ReplayMissError(
+                "{} is not a review-gator recording".format(self.directory))
+        with open(meta_filepath) as meta_file:
+            meta = json.load(meta_file)
+        if meta.get('now'):
+            self.now = datetime.datetime.fromisoformat(meta['now'])
+
+    def _path(self, backend, key, index):
+        key_hash = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.directory, backend,
+                            '{}-{}.json'.format(key_hash, index))
+
+    def _next_index(self, backend, key):
+        counter_key = (backend, key)
+        index = self._counters.get(counter_key, 0)
+        self._counters[counter_key] = index + 1
+        return index
+
+    def save(self, backend, key, interaction):
+        '''Record an interaction for key.'''
+        index = self._next_index(backend, key)
+        interaction = dict(interaction, key=key)
+        with open(self._path(backend, key, index), 'w') as out_file:
+            json.dump(interaction, out_file)
+
+    def load(self, backend, key):
+        '''Return the next recorded interaction for key.
+
+        Requests repeated more often than during recording are served the
+        last recorded interaction for that key.'''
+        index = self._next_index(backend, key)
+        path = self._path(backend, key, index)
+        while not os.path.exists(path) and index > 0:
+            index -= 1
+            path = self._path(backend, key, index)
+        if not os.path.exists(path):
+            raise ReplayMissError(
+                "No recorded {} interaction for {}".format(backend, key))
+        if self.latency:
+            time.sleep(self.latency)
+        with open(path) as in_file:
+            return json.load(in_file)
+
+
+def request_key(method, url, body=None):
+    '''Return the replay key identifying a request.'''
+    key = '{} {}'.format(method.upper(), url)
+    if body:
+        if not isinstance(body, bytes):
+            body = str(body).encode('utf-8')
+        key += ' ' + hashlib.sha1(body).hexdigest()
+    return key
+
+
+def encode_body(content):
+    if isinstance(content, str):
+        return {'body': content}
+    try:
+        return {'body': content.decode('utf-8'), 'encoding': 'bytes'}
+    except UnicodeDecodeError:
+        return {'body': base64.b64encode(content).decode('ascii'),
+                'encoding': 'base64'}
+
+
+def decode_body(interaction):
+    encoding = interaction.get('encoding')
+    if encoding == 'base64':
+        return base64.b64decode(interaction['body'])
+    if encoding == 'bytes':
+        return interaction['body'].encode('utf-8')
+    return interaction['body']
+
+
+def install(directory, replaying=False, latency=0.0, now=None):
+    '''Start recording to, or replaying from, directory.'''
+    global _STORE
+    _STORE = TrafficStore(directory, replaying=replaying, latency=latency,
+                          now=now)
+    return _STORE
+
+
+def uninstall():
+    global _STORE
+    _STORE = None
+    if 'github' in _patched:
+        from github.Requester import Requester
+        Requester.resetConnectionClasses()
+    if 'launchpad' in _patched:
+        import httplib2
+        httplib2.Http.request = _patched['launchpad']
+    _patched.clear()
+
+
+def get_store():
+    '''Return the active TrafficStore or None when not recording/replaying.'''
+    return _STORE
+
+
+def install_github():
+    '''Route PyGithub traffic through the active store, if any.'''
+    if _STORE is None or 'github' in _patched:
+        return
+    from github.Requester import (
+        HTTPRequestsConnectionClass,
+        HTTPSRequestsConnectionClass,
+        Requester)
+
+    class ReplayedResponse(object):
+        # mimic github.Requester.RequestsResponse
+        def __init__(self, interaction):
+            self.status = interaction['status']
+            self.headers = interaction['headers']
+            self._body = decode_body(interaction)
+
+        def getheaders(self):
+            return self.headers.items()
+
+        def read(self):
+            return self._body
+
+        def iter_content(self, chunk_size=1):
+            yield self._body
+
+        def raise_for_status(self):
+            pass
+
+    def make_connection_class(base):
+        class TrafficConnection(base):
+            def _key(self):
+                return request_key(self.verb, '{}://{}{}'.format(
+                    self.protocol, self.host, self.url), self.input)
+
+            def getresponse(self):
+                if _STORE.replaying:
+                    return ReplayedResponse(_STORE.load('github', self._key()))
+                response = super(TrafficConnection, self).getresponse()
+                interaction = {'status': response.status,
+                               'headers': dict(response.headers)}
+                interaction.update(encode_body(response.read()))
+                _STORE.save('github', self._key(), interaction)
+                return response
+        return TrafficConnection
+
+    Requester.injectConnectionClasses(
+        make_connection_class(HTTPRequestsConnectionClass),
+        make_connection_class(HTTPSRequestsConnectionClass))
+    _patched['github'] = True
+
+
+def install_launchpad():
+    '''Route launchpadlib traffic through the active store, if any.'''
+    if _STORE is None or 'launchpad' in _patched:
+        return
+    import httplib2
+    original_request = httplib2.Http.request
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                *args, **kwargs):
+        key = request_key(method, uri, body)
+        if _STORE.replaying:
+            interaction = _STORE.load('launchpad', key)
+            return (httplib2.Response(interaction['headers']),
+                    decode_body(interaction))
+        response, content = original_request(
+            self, uri, method, body, headers, *args, **kwargs)
+        headers = dict(response)
+        headers['status'] = str(response.status)
+        interaction = {'headers': headers}
+        interaction.update(encode_body(content))
+        _STORE.save('launchpad', key, interaction)
+        return response, content
+
+    httplib2.Http.request = request
+    _patched['launchpad'] = original_request
+
+
+def record_value(backend, key, value=None, error=None):
+    '''Record a non-HTTP result, such as the head commit date of a clone.'''
+    if _STORE is not None and not _STORE.replaying:
+        _STORE.save(backend, key, {'value': value, 'error': error})
+
+
+def replay_value(backend, key):
+    '''Return the recorded (value, error) pair for a non-HTTP result.'''
+    interaction = _STORE.load(backend, key)
+    return interaction['value'], interaction['error']
@@ -1,38 +1,52 @@
 #!/usr/bin/env python
 
+import copy
 import datetime
+import fnmatch
+import hashlib
+import json
 import os
+import re
 import shutil
 import socket
 import sys
 import tempfile
+import threading
 import time
 from collections import defaultdict
+from urllib.parse import urlencode, urlparse
 
 import click
-import github
-from github.GithubException import (
-    UnknownObjectException,
-    RateLimitExceededException)
-import humanize
-import lazr.restfulclient.errors
 import pytz
 import yaml
 
-from babel.dates import format_datetime
-from git import Repo as git_repo
-from git.exc import GitCommandError
-from jinja2 import Environment, FileSystemLoader
-from joblib import Parallel, delayed
-
-from lpshipit import _format_git_branch_name
 from importlib.resources import files
 
-from . import tox_runner
+from . import artifacts
 from . import clicklib
+from . import profiling
+from . import recorder
+from . import transport
 from .reporters import REPORTER_CLASSES
 
 MAX_DESCRIPTION_LENGTH = 80
+# Seconds between checks for config changes in --poll mode
+CONFIG_CHECK_INTERVAL = 5
+# Largest batch Launchpad will return for a single collection page
+LP_PAGE_SIZE = 300
+LP_CANDIDATE_STATUSES = ['Needs review', 'Work in progress']
+# How lp-git merge proposals are collected, see get_lp_repos
+LP_COLLECTION_STRATEGIES = ['repo', 'target']
+# Where the head commit of an lp-git source branch is found, see get_mps
+GIT_HEAD_SOURCES = ['clone', 'launchpad']
+# Reviews and latest activity of each Github pull request by url, kept
+# between runs in --poll mode to avoid requesting them again for pull
+# requests not updated since
+GITHUB_ACTIVITY = {}
+# Most results the Github search API returns for a query
+GITHUB_SEARCH_MAX_RESULTS = 1000
+# Before the first Github pull request, where split searches start
+GITHUB_SEARCH_EPOCH = datetime.datetime(2008, 1, 1, tzinfo=pytz.utc)
 
 
 def get_author_squad(author, squads) -> list[str]:
@@ -90,6 +104,11 @@ class Repo(object):
         self.parallel_tox = True
         self.tab_name = dedicated_tab_name
         self.tox = False
+        self.environment = None
+        # Set when the repo comes from an earlier snapshot of its source
+        self.stale_since = None
+        # The config entry the repo was collected for, see get_source_entries
+        self.config_key = None
 
     def __repr__(self):
         return 'Repo[{}, {}, {}, {}]'.format(
@@ -162,6 +181,17 @@ class PullRequest(object):
     def mp_id(self):
         return self.url.split('/')[-1]
 
+    def with_review_count(self, review_count):
+        '''Return this pull request showing review_count reviewer boxes.
+
+        Pull requests are shared by every config listing them, so one
+        configured with another review count is shown through a copy.'''
+        if review_count == self.review_count:
+            return self
+        pull_request = copy.copy(self)
+        pull_request.review_count = review_count
+        return pull_request
+
     def add_review(self, review):
         '''Adds a review, replacing any older review by the same owner.'''
         for idx, r in enumerate(self.reviews):
@@ -230,12 +260,91 @@ class LaunchpadReview(Review):
             'launchpad', handle, url, owner, state, date, review_before_latest_commit=review_before_latest_commit)
 
 
+class CollectionIndex(object):
+    '''Everything collected during a sweep, keyed by canonical url.
+
+    The same pull request (or github repo) can be referenced by several
+    sources, e.g. a launchpad branch and an owners scan, or a github repo
+    listed under several orgs or tabs. The index makes sure each one is
+    fetched and processed once and then attached to every repo referencing
+    it.
+
+    Each source is collected into a fork() of the index, merged back once
+    the source is collected in time, so that a source abandoned past its
+    deadline cannot change what later sources see.'''
+    COLLECTIONS = ('pull_requests', 'github_repos', 'lp_candidates',
+                   'lp_git_refs')
+
+    def __init__(self, github_activity=None):
+        self.pull_requests = {}
+        # Lowercased github repo full name -> (github repo, pull requests)
+        self.github_repos = {}
+        # Launchpad branch or git repository self_link -> candidate mps
+        self.lp_candidates = {}
+        # Launchpad git repository self_link -> {path: git branch ref}
+        self.lp_git_refs = {}
+        # Github pull request url -> activity kept between runs, see get_prs
+        self.github_activity = GITHUB_ACTIVITY if github_activity is None \
+            else github_activity
+        self.duplicates = 0
+
+    def fork(self):
+        '''Return a copy of the index to collect a source into.'''
+        index = CollectionIndex(dict(self.github_activity))
+        for name in self.COLLECTIONS:
+            setattr(index, name, dict(getattr(self, name)))
+        return index
+
+    def merge(self, index):
+        '''Add what was collected into index, a fork of this index.'''
+        for name in self.COLLECTIONS:
+            getattr(self, name).update(getattr(index, name))
+        # The fork also forgets the activity of closed pull requests
+        self.github_activity.clear()
+        self.github_activity.update(index.github_activity)
+        self.duplicates += index.duplicates
+
+    def __contains__(self, url):
+        return url in self.pull_requests
+
+    def get_pull_request(self, url):
+        '''Return the already collected pull request for url, if any.'''
+        pull_request = self.pull_requests.get(url)
+        if pull_request is not None:
+            self.duplicates += 1
+        return pull_request
+
+    def add_pull_request(self, pull_request):
+        self.pull_requests[pull_request.url] = pull_request
+
+
+class Team(object):
+    '''A config file and the report rendered from it.
+
+    Several teams can be collected in one sweep, each rendering its own
+    report from its repos into its own output directory.'''
+    def __init__(self, config_path, sources, output_directory):
+        self.config_path = config_path
+        self.sources = sources
+        self.output_directory = output_directory
+        self.repos = []
+        # None when the config is read from stdin and cannot be watched
+        self.config_mtime = None
+        if os.path.isfile(config_path):
+            self.config_mtime = os.stat(config_path).st_mtime
+
+    def __repr__(self):
+        return u'Team[{}, {}]'.format(self.config_path, self.output_directory)
+
+
 def date_to_age(date):
     if date is None:
         return None
     if date == '':
         return None
 
+    # deferred import of humanize until required
+    import humanize
     age = NOW - date
     if age < datetime.timedelta():
         # A negative timedelta means the time is in the future; this will be
@@ -252,81 +361,244 @@ def merge_two_dicts(x, y):
     return z
 
 
-def get_all_repos(gh, sources):
+def get_all_repos(gh, sources, index=None):
     '''Return all repos, prs and reviews for the given github sources.'''
     repos = []
     for org in sources:
         for name, data in sources[org].items():
             repo_name = '{}/{}'.format(org.replace(' ', ''), name)
-            try:
-                repo = gh.get_repo(repo_name)
-            except UnknownObjectException:
-                print_warning(
-                    ["{} WAS NOT FOUND".format(repo_name),
-                     "CHECK CREDENTIALS AND REPO NAME"]
-                )
+            gr = get_github_repo(gh, repo_name, data, index)
+            if gr is not None:
+                gr.config_key = ('github', 'repos', org, name)
+            if gr is not None and gr.pull_request_count > 0:
+                repos.append(gr)
+    return repos
+
+
+def get_github_repo(gh, repo_name, data, index=None):
+    '''Return the repo, prs and reviews for repo_name configured by data.
+
+    Returns None if the repo could not be fetched. A repo already in the
+    index is not fetched again, its pull requests are reused.'''
+    from github.GithubException import (
+        UnknownObjectException,
+        RateLimitExceededException)
+    review_count = data.get('review-count', 2)
+    dedicated_tab_name = data.get('tab-name', None)
+    if index is not None and repo_name.lower() in index.github_repos:
+        repo, pull_requests = index.github_repos[repo_name.lower()]
+        gr = GithubRepo(repo, repo.html_url, repo.ssh_url, dedicated_tab_name=dedicated_tab_name)
+        gr.tox = data.get('tox', False)
+        gr.parallel_tox = data.get('parallel-tox', True)
+        gr.environment = data.get('environment', None)
+        for pull_request in pull_requests:
+            gr.add(pull_request.with_review_count(review_count))
+        print(gr)
+        return gr
+    try:
+        repo = gh.get_repo(repo_name)
+    except UnknownObjectException:
+        print_warning(
+            ["{} WAS NOT FOUND".format(repo_name),
+             "CHECK CREDENTIALS AND REPO NAME"]
+        )
+        return None
+    except RateLimitExceededException as rle:
+        print_warning(
+            ["Rate Limit Exception!",
+             str(rle)]
+        )
+        return None
+    gr = GithubRepo(repo, repo.html_url, repo.ssh_url, dedicated_tab_name=dedicated_tab_name)
+    gr.tox = data.get('tox', False)
+    gr.parallel_tox = data.get('parallel-tox', True)
+    gr.environment = data.get('environment', None)
+    pull_requests = get_prs(gr, repo, review_count, dedicated_tab_name, index)
+    if index is not None:
+        index.github_repos[repo_name.lower()] = (repo, pull_requests)
+    print(gr)
+    return gr
+
+
+def get_org_repo_settings(name, patterns):
+    '''Return the settings for repo name from an org's pattern settings.
+
+    The settings of every fnmatch pattern matching name are merged in the
+    order they are listed, so a leading '*' entry can supply defaults. None
+    is returned if no pattern matches or name matches the 'exclude' list.'''
+    if any(fnmatch.fnmatch(name, pattern)
+           for pattern in patterns.get('exclude', None) or []):
+        return None
+    settings = None
+    for pattern, data in patterns.items():
+        if pattern == 'exclude' or not fnmatch.fnmatch(name, pattern):
+            continue
+        settings = merge_two_dicts(settings or {}, data or {})
+    return settings
+
+
+def search_pr_repo_names(gh, query, start=None, end=None):
+    '''Return the full names of the repos of the pull requests found by
+    query, created between start and end if given.
+
+    The search API returns GITHUB_SEARCH_MAX_RESULTS results at most, so a
+    query finding more is split in two by creation date until each part
+    finds few enough.'''
+    date_format = '%Y-%m-%dT%H:%M:%SZ'
+    dated_query = query
+    if start is not None:
+        dated_query = '{} created:{}..{}'.format(
+            query, start.strftime(date_format), end.strftime(date_format))
+    results = gh.search_issues(dated_query)
+    if results.totalCount > GITHUB_SEARCH_MAX_RESULTS:
+        if start is None:
+            start, end = GITHUB_SEARCH_EPOCH, NOW.astimezone(pytz.utc)
+        if end - start > datetime.timedelta(seconds=1):
+            middle = (start + (end - start) / 2).replace(microsecond=0)
+            return (search_pr_repo_names(gh, query, start, middle) |
+                    search_pr_repo_names(
+                        gh, query, middle + datetime.timedelta(seconds=1),
+                        end))
+        print_warning(
+            ["{} finds {} pull requests created in the same second".format(
+                dated_query, results.totalCount),
+             "Only the repos of the first {} are collected".format(
+                 GITHUB_SEARCH_MAX_RESULTS)])
+    return {issue.repository_url.split('/repos/', 1)[-1]
+            for issue in results}
+
+
+def get_org_repos(gh, sources, collected, index=None):
+    '''Return all repos, prs and reviews for the given github orgs or users.
+
+    Instead of listing every repository, the search API is used to find the
+    repositories that have open pull requests, so repositories without any
+    cost no requests at all. Orgs with more open pull requests than the
+    search API returns are searched by creation date ranges, see
+    search_pr_repo_names. Repositories whose lowercased full name is in
+    collected are skipped.'''
+    repos = []
+    for org, patterns in sources.items():
+        query = 'is:pr is:open archived:false user:{}'.format(
+            org.replace(' ', ''))
+        repo_names = search_pr_repo_names(gh, query)
+        print('{}: {} repos with open pull requests'.format(
+            org, len(repo_names)))
+        for repo_name in sorted(repo_names):
+            if repo_name.lower() in collected:
                 continue
-            except RateLimitExceededException as rle:
-                print_warning(
-                    ["Rate Limit Exception!",
-                     str(rle)]
-                )
-            review_count = sources[org][name]['review-count']
-            dedicated_tab_name = sources[org][name].get('tab-name', None)
-            gr = GithubRepo(repo, repo.html_url, repo.ssh_url, dedicated_tab_name=dedicated_tab_name)
-            gr.tox = sources[org][name].get('tox', False)
-            gr.parallel_tox = sources[org][name].get('parallel-tox', True)
-            gr.environment = sources[org][name].get('environment', None)
-            get_prs(gr, repo, review_count, dedicated_tab_name)
-            if gr.pull_request_count > 0:
+            data = get_org_repo_settings(repo_name.split('/')[-1],
+                                         patterns or {})
+            if data is None:
+                continue
+            collected.add(repo_name.lower())
+            gr = get_github_repo(gh, repo_name, data, index)
+            if gr is not None:
+                gr.config_key = ('github', 'orgs', org)
+            if gr is not None and gr.pull_request_count > 0:
                 repos.append(gr)
-            print(gr)
     return repos
 
 
-def get_prs(gr, repo, review_count, dedicated_tab_name=None):
-    '''Return all pull request for the given repository.'''
+def get_github_comments_since(p, since):
+    '''Return the issue comments on pull request p updated since a date.
+
+    PyGithub does not offer the since filter of this API for pull requests,
+    only for issues.'''
+    # deferred import of PyGithub until required
+    from github.IssueComment import IssueComment
+    from github.PaginatedList import PaginatedList
+    return PaginatedList(
+        IssueComment, p._requester, '{}/comments'.format(p.issue_url),
+        {'since': since.astimezone(pytz.utc).strftime('%Y-%m-%dT%H:%M:%SZ')})
+
+
+def get_github_activity(p, since):
+    '''Return the reviews of pull request p and its latest activity.
+
+    The latest activity is when p was created, or when its newest review,
+    review comment or issue comment was, whichever is the latest. Only the
+    comments created after since, when the latest activity is known to be at
+    least since, can change it, so only the comments updated since then are
+    requested, and none at all once the activity reaches p.updated_at, which
+    no activity is later than.'''
+    updated_at = localize_datetime(p.updated_at)
+    latest_activity = max(localize_datetime(p.created_at), since)
+
+    reviews = []
+    for raw_review in p.get_reviews():
+        if raw_review.state == 'PENDING':
+            continue
+        reviews.append(GithubReview(
+            raw_review, raw_review.html_url, raw_review.user.login,
+            raw_review.state, raw_review.submitted_at))
+    for review in reviews:
+        # Review might be more recent than a comment
+        latest_activity = max(latest_activity, review.date)
+
+    if latest_activity < updated_at:
+        # Newest review comment first, only the first page is fetched
+        for raw_comment in p.get_review_comments(
+                sort='created', direction='desc', since=latest_activity):
+            latest_activity = max(
+                latest_activity, localize_datetime(raw_comment.created_at))
+            break
+    if latest_activity < updated_at:
+        for raw_issue_comment in get_github_comments_since(
+                p, latest_activity):
+            latest_activity = max(latest_activity, localize_datetime(
+                raw_issue_comment.created_at))
+    return reviews, latest_activity
+
+
+def get_prs(gr, repo, review_count, dedicated_tab_name=None, index=None):
+    '''Return all pull request for the given repository.
+
+    Pull requests already in the index are reused rather than processed
+    again. The reviews and latest activity of each pull request are kept
+    between runs in --poll mode, and only requested again once the pull
+    request was updated.'''
+    activity = GITHUB_ACTIVITY if index is None else index.github_activity
     pull_requests = []
     pulls = repo.get_pulls()
     for p in pulls:
+        if index is not None:
+            pr = index.get_pull_request(p.html_url)
+            if pr is not None:
+                pull_requests.append(pr)
+                gr.add(pr.with_review_count(review_count))
+                continue
         pr = GithubPullRequest(p, p.html_url, p.title, p.user.login,
                             p.state, p.created_at, review_count, dedicated_tab_name)
         gr.add(pr)
         pull_requests.append(pr)
-        raw_reviews = p.get_reviews()
-        raw_comments = p.get_comments()
-        raw_issue_comments = p.get_issue_comments()
-        pr_latest_activity = localize_datetime(p.created_at)
-
-        # Find most recent issue comment activity on pull request
-        for raw_issue_comment in raw_issue_comments:
-            issue_comment_created_at = localize_datetime(
-                raw_issue_comment.created_at)
-            if pr_latest_activity is None or (
-                    issue_comment_created_at > pr_latest_activity):
-                pr_latest_activity = issue_comment_created_at
-
-        # Find most recent comment activity on pull request
-        for raw_comment in raw_comments:
-            comment_created_at = localize_datetime(
-                raw_comment.created_at)
-            if pr_latest_activity is None or (
-                    comment_created_at > pr_latest_activity):
-                pr_latest_activity = comment_created_at
-
-        for raw_review in raw_reviews:
-            if raw_review.state == 'PENDING':
-                continue
-            owner = raw_review.user.login
-            review = GithubReview(raw_review, raw_review.html_url, owner,
-                                  raw_review.state, raw_review.submitted_at)
+        if index is not None:
+            index.add_pull_request(pr)
+
+        updated_at = localize_datetime(p.updated_at)
+        cached = activity.get(p.html_url)
+        if cached is not None and cached['updated_at'] == updated_at:
+            reviews, latest_activity = \
+                cached['reviews'], cached['latest_activity']
+        else:
+            # The review set may have changed, so all reviews are requested
+            reviews, latest_activity = get_github_activity(
+                p, cached['latest_activity'] if cached else pr.date)
+            activity[p.html_url] = {
+                'updated_at': updated_at,
+                'reviews': reviews,
+                'latest_activity': latest_activity,
+            }
+        for review in reviews:
             pr.add_review(review)
-            review_date = localize_datetime(raw_review.submitted_at)
-            # Review might be more recent than a comment
-            if pr_latest_activity is None or review_date > pr_latest_activity:
-                pr_latest_activity = review_date
+        pr.latest_activity = latest_activity
 
-        pr.latest_activity = pr_latest_activity
+    # Forget the pull requests of this repository that are no longer open
+    open_urls = {pr.url for pr in pull_requests}
+    prefix = '{}/pull/'.format(repo.html_url)
+    for url in [url for url in list(activity)
+                if url.startswith(prefix) and url not in open_urls]:
+        del activity[url]
 
     return pull_requests
 
@@ -348,13 +620,23 @@ def get_repo_data(repos, squads):
     '''Render the list of repos, their prs and reviews into an html table.'''
     repo_data = {}
     for repo in repos:
-        repo_data[repo.name] = {
+        repo_key = repo.name
+        if repo_key in repo_data:
+            # The same repo shown in another view, e.g. a dedicated tab
+            repo_key = '{} ({})'.format(repo.name, repo.tab_name)
+        view = 2
+        while repo_key in repo_data:
+            # A third view, or another one with the same tab
+            repo_key = '{} ({}) #{}'.format(repo.name, repo.tab_name, view)
+            view += 1
+        repo_data[repo_key] = {
             'repo_url': repo.url,
             'repo_name': repo.name,
             'tox': repo.tox,
             'repo_shortname': repo.name.split('/')[-1],
             'pull_requests': get_pr_data(repo.pull_requests, squads),
             'tab_name': repo.tab_name,
+            'stale_age': date_to_age(repo.stale_since),
         }
     repo_data['dedicated_tabs'] = [repo.get('tab_name') for repo in repo_data.values() if repo.get('tab_name', None)]
     return repo_data
@@ -366,8 +648,57 @@ def report_repo_data(data):
             reporter_cls().process_data(data)
 
 
+def get_page_filename(prefix, name):
+    '''Return a safe html filename for a squad or dedicated tab page.
+
+    Names changed to be safe, which could then clash with another name (e.g.
+    "web ui" and "web-ui"), are told apart by a short hash of the name.'''
+    slug = re.sub(r'[^A-Za-z0-9_.-]+', '-', name)
+    if slug != name:
+        slug = '{}-{}'.format(
+            slug, hashlib.sha1(name.encode('utf-8')).hexdigest()[:8])
+    return '{}-{}.html'.format(prefix, slug)
+
+
+def filter_repo_data(data, keep):
+    '''Return a copy of the repo data with only the prs keep(repo, pr) accepts.
+
+    Repos left without pull requests are dropped.'''
+    filtered = {}
+    for repo_name, repo in data.items():
+        if repo_name == 'dedicated_tabs':
+            continue
+        pull_requests = [pull_request for pull_request in repo['pull_requests']
+                         if keep(repo, pull_request)]
+        if pull_requests:
+            filtered[repo_name] = merge_two_dicts(
+                repo, {'pull_requests': pull_requests})
+    filtered['dedicated_tabs'] = sorted(
+        {repo['tab_name'] for repo in filtered.values() if repo['tab_name']})
+    return filtered
+
+
+def write_template(tmpl, context, output_html_filepath):
+    '''Stream the rendered template to output_html_filepath.
+
+    The page is generated chunk by chunk into a temporary file which then
+    replaces the output file, so the whole page is never held in memory and
+    viewers never see a partially written page.'''
+    tmp_filepath = '{}.tmp'.format(output_html_filepath)
+    with open(tmp_filepath, 'w') as out_file:
+        for chunk in tmpl.generate(context):
+            out_file.write(chunk)
+    os.replace(tmp_filepath, output_html_filepath)
+
+
 def render(repos, output_directory, tox, squads):
-    '''Render the repositories into an html file.'''
+    '''Render the repositories into html files.
+
+    Besides reviews.html with every repo, a page per squad and per dedicated
+    tab containing only its own rows is written, along with an index.html
+    linking them all.'''
+    # deferred import of jinja2 until required
+    from jinja2 import Environment, FileSystemLoader
     data = get_repo_data(repos, squads)
     report_repo_data(data)
     abs_templates_path = os.path.join(os.path.dirname(
@@ -376,20 +707,69 @@ def render(repos, output_directory, tox, squads):
             os.path.realpath(__file__)), "vendor")
     env = Environment(loader=FileSystemLoader(abs_templates_path))
     tmpl = env.get_template('reviews.html')
+    squad_names = sorted(squads.keys()) if squads else []
 
     # Make sure the output directory exists
     os.makedirs(output_directory, exist_ok=True)
     output_html_filepath = os.path.join(output_directory, 'reviews.html')
-    with open(output_html_filepath, 'w') as out_file:
-        context = {
-            'repos': data,
-            'generation_time': NOW,
-            'tox': tox,
-            'squads': sorted(squads.keys()) if squads else []
-        }
-        out_file.write(tmpl.render(context))
-        print("**** {} written ****".format(output_html_filepath))
-        print("file://{}".format(output_html_filepath))
+    context = {
+        'repos': data,
+        'generation_time': NOW,
+        'tox': tox,
+        'squads': squad_names,
+        'shard': False,
+        'stale_repo_count': len([repo for repo in repos if repo.stale_since]),
+    }
+    write_template(tmpl, context, output_html_filepath)
+    print("**** {} written ****".format(output_html_filepath))
+    print("file://{}".format(output_html_filepath))
+
+    pages = []
+    for squad_name in squad_names:
+        pages.append(('Squad', squad_name,
+                      get_page_filename('squad', squad_name),
+                      filter_repo_data(
+                          data, lambda repo, pull_request, squad=squad_name:
+                          squad in pull_request['squads'])))
+    for tab_name in sorted(set(data['dedicated_tabs'])):
+        pages.append(('Dedicated', tab_name,
+                      get_page_filename('tab', tab_name),
+                      filter_repo_data(
+                          data, lambda repo, pull_request, tab=tab_name:
+                          repo['tab_name'] == tab)))
+
+    written = set()
+    for kind, name, filename, page_data in pages:
+        page_context = merge_two_dicts(context, {
+            'repos': page_data,
+            'squads': [],
+            'shard': True,
+            'page_title': '{}: {}'.format(kind, name),
+        })
+        write_template(tmpl, page_context,
+                       os.path.join(output_directory, filename))
+        written.add(filename)
+
+    # Remove pages of squads and tabs that no longer exist
+    for filename in os.listdir(output_directory):
+        if (filename.startswith(('squad-', 'tab-')) and
+                filename.endswith('.html') and filename not in written):
+            os.remove(os.path.join(output_directory, filename))
+
+    index_context = {
+        'generation_time': NOW,
+        'pages': [{
+            'kind': kind,
+            'name': name,
+            'filename': filename,
+            'pull_request_count': sum(
+                len(repo['pull_requests']) for repo_name, repo
+                in page_data.items() if repo_name != 'dedicated_tabs'),
+        } for kind, name, filename, page_data in pages],
+    }
+    write_template(env.get_template('index.html'), index_context,
+                   os.path.join(output_directory, 'index.html'))
+
     output_vendor_dir = os.path.join(output_directory, 'vendor')
     shutil.rmtree(output_vendor_dir, True)
     # Copy the vendored CSS and JS
@@ -439,16 +819,116 @@ def get_mp_title(mp):
     return title
 
 
-def get_candidate_mps(branch):
+class PrefetchedVote(object):
+    '''A merge proposal vote whose comment is resolved from prefetched comments.'''
+    def __init__(self, vote, comments):
+        self._vote = vote
+        self._comments = comments
+
+    def __getattr__(self, name):
+        return getattr(self._vote, name)
+
+    @property
+    def comment(self):
+        comment_link = self._vote.comment_link
+        if comment_link is None:
+            return None
+        if comment_link in self._comments:
+            return self._comments[comment_link]
+        # Not among the prefetched comments, fall back to a lazy load
+        return self._vote.comment
+
+
+class PrefetchedMergeProposal(object):
+    '''A merge proposal with its comments loaded up front.
+
+    Its votes are loaded with a single request when first used, so merge
+    proposals dropped by the age cutoff never load them.'''
+    def __init__(self, lp, mp, all_comments):
+        self._lp = lp
+        self._mp = mp
+        self._votes = None
+        self.all_comments = all_comments
+
+    def __getattr__(self, name):
+        return getattr(self._mp, name)
+
+    @property
+    def votes(self):
+        if self._votes is None:
+            comments = {comment.self_link: comment
+                        for comment in self.all_comments}
+            self._votes = [PrefetchedVote(vote, comments)
+                           for vote in load_lp_collection(
+                               self._lp, self._mp.votes_collection_link)]
+        return self._votes
+
+
+def load_lp_collection(lp, link, **params):
+    '''Load a Launchpad collection, fetching LP_PAGE_SIZE entries per request.
+
+    Keyword arguments are passed as query parameters. Later pages are
+    fetched through next_collection_link which keeps the page size. Results
+    of named operations cannot be loaded this way, see load_lp_operation.'''
+    query = [(key.replace('ws_', 'ws.'), value)
+             for key, value in sorted(params.items())]
+    query.append(('ws.size', LP_PAGE_SIZE))
+    return lp.load('{}?{}'.format(link, urlencode(query, doseq=True)))
+
+
+def prefetch_mp(lp, mp):
+    '''Load the comments of mp with one request, and its votes with another
+    once they are used.
+
+    Vote comments are resolved from the loaded comments rather than with a
+    request per vote.'''
+    all_comments = list(load_lp_collection(
+        lp, mp.all_comments_collection_link))
+    return PrefetchedMergeProposal(lp, mp, all_comments)
+
+
+def load_lp_operation(lp, resource, name, **params):
+    '''Call the named GET operation name of a Launchpad resource, fetching
+    LP_PAGE_SIZE entries per request.
+
+    The collection a named operation returns has no resource_type_link, so
+    it cannot be loaded with lp.load, and the operation's WADL has no
+    ws.size parameter. The request lazr would send is given one, and its
+    response processed the way lazr processes it.'''
+    operation = getattr(resource, name)
+    url = operation.wadl_method.build_request_url(
+        **{key: json.dumps(value) for key, value in params.items()})
+    url = '{}&{}'.format(url, urlencode({'ws.size': LP_PAGE_SIZE}))
+    response, content = lp._browser._request(url)
+    return operation._handle_200_response(url, response, content)
+
+
+def get_target_mps(lp, target):
+    '''Return the open merge proposals of a Launchpad project or person.'''
+    return load_lp_operation(lp, target, 'getMergeProposals',
+                             status=LP_CANDIDATE_STATUSES)
+
+
+def get_candidate_mps(branch, index=None):
+    '''Return the open merge proposals of branch.
+
+    Those of a branch already in the index are not requested again.'''
+    if index is not None and branch.self_link in index.lp_candidates:
+        return index.lp_candidates[branch.self_link]
     try:
         mps = branch.getMergeProposals(status='Needs review')
         mps.extend(branch.getMergeProposals(status='Work in progress'))
     except AttributeError:
         mps = branch.landing_candidates
+    if index is not None:
+        mps = list(mps)
+        index.lp_candidates[branch.self_link] = mps
     return mps
 
 
 def get_git_repo(path, checkout, tmpdir):
+    # deferred import of GitPython until required
+    from git import Repo as git_repo
     cloned_repo = git_repo.clone_from(path, tmpdir, branch=checkout, multi_options=[
         '--single-branch',
         '--no-checkout',
@@ -457,50 +937,154 @@ def get_git_repo(path, checkout, tmpdir):
 
     return cloned_repo
 
-def get_mps(repo, branch, max_age=None, output_directory=None):
-    '''Return all merge proposals for the given branch.'''
-    mps = get_candidate_mps(branch)
-    tox_mps = []
-    for mp in mps:
-        _, owner = mp.registrant_link.split('~')
-        title = get_mp_title(mp)
 
-        pr = LaunchpadPullRequest(mp, mp.web_link, title, owner,
-                                  mp.queue_status,
-                                  mp.date_created, 2)
-        mp_latest_activity = None
-
-        if repo.tox and pr.state == 'Needs review':
-            repo.add_requiring_tox(mp, repo.environment)
+def get_git_head_date(path, checkout):
+    '''Return the commit date of the head of checkout in the git repo path.'''
+    from git.exc import GitCommandError
+    record_key = '{} {}'.format(path, checkout)
+    store = recorder.get_store()
+    if store is not None and store.replaying:
+        value, error = recorder.replay_value('git', record_key)
+        if error is not None:
+            raise GitCommandError('clone', error)
+        return datetime.datetime.fromisoformat(value)
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cloned_repo = get_git_repo(path, checkout, tmpdir)
+            head_date = cloned_repo.head.commit.committed_datetime.astimezone(
+                pytz.utc)
+    except GitCommandError as git_exc:
+        recorder.record_value('git', record_key, error=git_exc.status)
+        raise
+    recorder.record_value('git', record_key, value=head_date.isoformat())
+    return head_date
+
+
+def get_lp_git_branches(lp, repository_link, index=None):
+    '''Return the branches (refs/heads) of a Launchpad git repository by
+    path.
+
+    All branches are loaded in pages of LP_PAGE_SIZE, so the merge proposals
+    of every branch of a repository take the same requests as a single one.
+    Tags are not loaded. The branches of a repository already in the index
+    are not loaded again.'''
+    if index is not None and repository_link in index.lp_git_refs:
+        return index.lp_git_refs[repository_link]
+    repository = lp.load(repository_link)
+    branches = {ref.path: ref
+                for ref in load_lp_collection(
+                    lp, repository.branches_collection_link)}
+    if index is not None:
+        index.lp_git_refs[repository_link] = branches
+    return branches
+
+
+def get_lp_git_head_date(mp, ref):
+    '''Return the date of the head commit of ref, the source branch of mp,
+    found through the Launchpad API rather than a clone.
+
+    Launchpad does not export commit dates, so this is the date the head
+    commit was scanned by Launchpad, i.e. that of the merge proposal's
+    preview diff for it. Returns None if that diff is yet to be made, as
+    when the head was pushed is then unknown.'''
+    preview_diff = mp.preview_diff
+    if (preview_diff is not None and
+            preview_diff.source_revision_id == ref.commit_sha1):
+        return preview_diff.date_created.astimezone(pytz.utc)
+    return None
+
+
+def get_mps(repo, branch, max_age=None, output_directory=None, mps=None,
+            index=None, lp=None):
+    '''Return all merge proposals for the given branch.
+
+    If mps is given, those already fetched merge proposals are used instead
+    of querying the branch for its candidates. Merge proposals already in
+    the index are attached to repo without being processed again.
+
+    Each merge proposal is first checked against the age cutoff, which only
+    needs its comments. The title, votes, clone of the source branch and tox
+    run are only worked out for the merge proposals that are kept.
+
+    If lp, a Launchpad client, is given the head of a git source branch is
+    found through the Launchpad API (see get_lp_git_head_date) instead of a
+    clone, which needs neither git nor access to git.launchpad.net.'''
+    # deferred import of lazr until required
+    import lazr.restfulclient.errors
+    if mps is None:
+        mps = get_candidate_mps(branch, index)
+    cutoff_date = None
+    if max_age is not None:
+        cutoff_date = NOW - datetime.timedelta(days=max_age)
+    for mp in mps:
+        if index is not None:
+            existing_pr = index.get_pull_request(mp.web_link)
+            if existing_pr is not None:
+                # Collected for another config, which may have a different
+                # age cutoff or no tox run
+                if cutoff_date is not None and \
+                        existing_pr.latest_activity is not None and \
+                        existing_pr.latest_activity < cutoff_date:
+                    continue
+                if repo.tox and existing_pr.state == 'Needs review':
+                    repo.add_requiring_tox(existing_pr.handle,
+                                           repo.environment)
+                repo.add(existing_pr)
+                continue
 
         # Find most recent activity on merge proposal
+        mp_latest_activity = None
         for mp_comment in mp.all_comments:
             if mp_latest_activity is None or \
                             mp_comment.date_created > mp_latest_activity:
                 mp_latest_activity = mp_comment.date_created
 
-        if max_age is not None and mp_latest_activity is not None:
-            cutoff_date = NOW - datetime.timedelta(days=max_age)
+        if cutoff_date is not None and mp_latest_activity is not None:
             if mp_latest_activity < cutoff_date:
                 continue
 
+        _, owner = mp.registrant_link.split('~')
+        title = get_mp_title(mp)
+
+        pr = LaunchpadPullRequest(mp, mp.web_link, title, owner,
+                                  mp.queue_status,
+                                  mp.date_created, 2)
+
+        if repo.tox and pr.state == 'Needs review':
+            repo.add_requiring_tox(mp, repo.environment)
+
         repo.add(pr)
+        if index is not None:
+            index.add_pull_request(pr)
         cloned_head_date = None
-        try:
-            if pr.state == 'Needs review' and mp.source_git_repository_link is not None:
-                src_git_repo = mp.source_git_repository_link.replace(
-                    'https://api.launchpad.net/devel/',
-                    'lp:')
-                with tempfile.TemporaryDirectory() as tmpdir:
-                    branch = mp.source_git_path.replace('refs/heads/', '')
-                    cloned_repo = get_git_repo(src_git_repo, branch, tmpdir)
-                    cloned_head_date = cloned_repo.head.commit.committed_datetime.astimezone(pytz.utc)
-        except GitCommandError:
-            print("Warning: There was a problem cloning branch {} from {}."
-                  "The branch is likely missing. As such we are unable to determine "
-                  "if a review was submitted before subsequent changes have been "
-                  "pushed to the source branch."
-                  .format(branch, src_git_repo))
+        if pr.state == 'Needs review' and mp.source_git_repository_link is not None:
+            src_git_repo = mp.source_git_repository_link.replace(
+                'https://api.launchpad.net/devel/',
+                'lp:')
+            branch = mp.source_git_path.replace('refs/heads/', '')
+            if lp is not None:
+                branches = get_lp_git_branches(
+                    lp, mp.source_git_repository_link, index)
+                if mp.source_git_path in branches:
+                    cloned_head_date = get_lp_git_head_date(
+                        mp, branches[mp.source_git_path])
+                else:
+                    print("Warning: Branch {} was not found in {}. As such we "
+                          "are unable to determine if a review was "
+                          "submitted before subsequent changes have been "
+                          "pushed to the source branch.".format(
+                              branch, src_git_repo))
+            else:
+                # deferred import of GitPython until required
+                from git.exc import GitCommandError
+                try:
+                    cloned_head_date = get_git_head_date(src_git_repo, branch)
+                except GitCommandError:
+                    print("Warning: There was a problem cloning branch {} from {}."
+                          "The branch is likely missing. As such we are unable to determine "
+                          "if a review was submitted before subsequent changes have been "
+                          "pushed to the source branch."
+                          .format(branch, src_git_repo))
 
         for vote in mp.votes:
             owner = vote.reviewer.display_name
@@ -529,7 +1113,31 @@ def get_mps(repo, branch, max_age=None, output_directory=None):
         pr.latest_activity = mp_latest_activity
 
 
-def get_branches_for_owner(lp, collected, owner, max_age):
+def get_known_names(known_repos, source_name):
+    '''Return the names, as used by the collectors of source_name to skip
+    repos already collected, of the known_repos of that source.
+
+    These are 'org/name' for github repos, the API link for lp-git
+    repositories and the display name for launchpad branches.'''
+    names = set()
+    for repo in known_repos:
+        if repo.config_key is None or repo.config_key[0] != source_name:
+            continue
+        if source_name == 'github':
+            names.add(urlparse(repo.url).path.strip('/').lower())
+        elif source_name == 'lp-git':
+            if repo.handle is not None:
+                names.add(repo.handle.self_link)
+            else:
+                # Repos of a snapshot only have their web link
+                names.add(repo.url.replace('https://code.launchpad.net/',
+                                           'https://api.launchpad.net/devel/'))
+        else:
+            names.add(repo.name)
+    return names
+
+
+def get_branches_for_owner(lp, collected, owner, max_age, index=None):
     '''Return all repos and prs for the given owner with the age limit.
 
     This is used to identify any recently submitted prs that escaped the
@@ -543,25 +1151,26 @@ def get_branches_for_owner(lp, collected, owner, max_age):
         if b.display_name in collected:
             continue
         branch = LaunchpadRepo(b, b.web_link, b.display_name)
-        get_mps(branch, b)
+        get_mps(branch, b, index=index)
         if branch.pull_request_count > 0:
             repos.append(branch)
     return repos
 
 
-def get_branches(sources, lp_credentials_store=None):
-    '''Return all repos, prs and reviews for the given launchpad sources.'''
-    # deferred import of launchpadagent until required
-    from . import launchpadagent
+def get_branches(sources, lp_credentials_store=None, index=None,
+                 request_timeout=None, known_repos=()):
+    '''Return all repos, prs and reviews for the given launchpad sources.
+
+    Branches of known_repos, already collected, are skipped by the owners
+    scan.'''
     cachedir_prefix = os.environ.get('SNAP_USER_COMMON', "/tmp")
     launchpad_cachedir = os.path.join('{}/get_reviews/.launchpadlib'.format(cachedir_prefix))
-    # deferred import of launchpadagent until required
-    from . import launchpadagent
-    lp = launchpadagent.get_launchpad(
+    lp = transport.get_launchpad(
         launchpadlib_dir=launchpad_cachedir,
-        lp_credentials_store=lp_credentials_store)
+        lp_credentials_store=lp_credentials_store,
+        timeout=request_timeout)
     repos = []
-    for source, data in sources['branches'].items():
+    for source, data in sources.get('branches', {}).items():
         print(source, data)
         b = lp.branches.getByUrl(url=source)
         try:
@@ -576,30 +1185,51 @@ def get_branches(sources, lp_credentials_store=None):
         repo.parallel_tox = data.get('parallel-tox', True)
         repo.environment = data.get('environment', None)
         repo.tab_name = data.get('tab-name', None)
-        get_mps(repo, b)
+        repo.config_key = ('launchpad', 'branches', source)
+        get_mps(repo, b, index=index)
         if repo.pull_request_count > 0:
             repos.append(repo)
         print(repo)
-    collected = [r.name for r in repos]
-    print('collected: {}'.format(collected))
-    for owner, data in sources['owners'].items():
+    collected = {r.name for r in repos}
+    collected.update(get_known_names(known_repos, 'launchpad'))
+    print('collected: {}'.format(sorted(collected)))
+    for owner, data in sources.get('owners', {}).items():
         print(owner, data)
-        repos.extend(get_branches_for_owner(
-            lp, collected, owner, data['max-age']))
+        owner_repos = get_branches_for_owner(
+            lp, collected, owner, data['max-age'], index)
+        for repo in owner_repos:
+            repo.config_key = ('launchpad', 'owners', owner)
+        repos.extend(owner_repos)
     return repos
 
 
-def get_lp_repos(sources, output_directory=None, lp_credentials_store=None):
-    '''Return all repos, prs and reviews for the given lp-git source.'''
-    # deferred import of launchpadagent until required
-    from . import launchpadagent
+def get_lp_repos(sources, output_directory=None, lp_credentials_store=None,
+                 collection='repo', index=None, request_timeout=None,
+                 git_head_source='clone', known_repos=()):
+    '''Return all repos, prs and reviews for the given lp-git source.
+
+    With the 'repo' collection strategy each repository is asked for its
+    merge proposals. With the 'target' strategy the merge proposals of each
+    project (or person, for personal repositories) are fetched in large pages
+    together with their comments and votes, and fanned out to the configured
+    repositories, which takes far fewer requests for teams with many repos.
+
+    The head commit of each source branch is found by cloning it with the
+    'clone' git_head_source, or from its repository's refs on Launchpad with
+    the 'launchpad' one. Repositories of known_repos, already collected, are
+    skipped by the owners scan.'''
     cachedir_prefix = os.environ.get('SNAP_USER_COMMON', "/tmp")
     launchpad_cachedir = os.path.join('{}/get_reviews/.launchpadlib'.format(cachedir_prefix))
-    lp = launchpadagent.get_launchpad(
+    lp = transport.get_launchpad(
         launchpadlib_dir=launchpad_cachedir,
-        lp_credentials_store=lp_credentials_store)
+        lp_credentials_store=lp_credentials_store,
+        timeout=request_timeout)
+    head_lp = lp if git_head_source == 'launchpad' else None
     repos = []
-    for source, data in sources['repos'].items():
+    collected = get_known_names(known_repos, 'lp-git')
+    # Repos by target link, collected after the loop by the target strategy
+    pending_by_target = defaultdict(list)
+    for source, data in sources.get('repos', {}).items():
         print(source, data)
         b = lp.git_repositories.getByPath(path=source.replace('lp:', ''))
         try:
@@ -614,20 +1244,117 @@ def get_lp_repos(sources, output_directory=None, lp_credentials_store=None):
         repo.parallel_tox = data.get('parallel-tox', True)
         repo.environment = data.get('environment', None)
         repo.tab_name = data.get('tab-name', None)
+        repo.config_key = ('lp-git', 'repos', source)
         max_age = data.get('max-age', None)
-        get_mps(repo, b, max_age, output_directory)
+        collected.add(b.self_link)
+        # Source package repos have no target level merge proposal query
+        if collection == 'target' and '/+source/' not in b.target_link:
+            pending_by_target[b.target_link].append((repo, b, max_age))
+            continue
+        get_mps(repo, b, max_age, output_directory, index=index, lp=head_lp)
         if repo.pull_request_count > 0:
             repos.append(repo)
         print(repo)
+    for target_link, pending in pending_by_target.items():
+        repos.extend(get_lp_repos_for_target(
+            lp, target_link, pending, output_directory, index,
+            git_head_source))
+    for owner, data in sources.get('owners', {}).items():
+        print(owner, data)
+        owner_repos = get_lp_repos_for_owner(
+            lp, collected, owner, (data or {}).get('max-age', None),
+            output_directory, collection, index, git_head_source)
+        for repo in owner_repos:
+            repo.config_key = ('lp-git', 'owners', owner)
+        repos.extend(owner_repos)
     return repos
 
 
-def get_repos(sources, github_username, github_password, github_token):
+def get_lp_repos_for_target(lp, target_link, pending, output_directory=None,
+                            index=None, git_head_source='clone'):
+    '''Collect the mps of all pending repos sharing target_link at once.
+
+    pending is a list of (LaunchpadRepo, git repository, max_age) tuples.'''
+    repos_by_link = {b.self_link: (repo, b, max_age)
+                     for repo, b, max_age in pending}
+    mps_by_repo = defaultdict(list)
+    for mp in get_target_mps(lp, lp.load(target_link)):
+        if mp.target_git_repository_link in repos_by_link:
+            # Merge proposals already collected need no prefetching
+            if index is None or mp.web_link not in index:
+                mp = prefetch_mp(lp, mp)
+            mps_by_repo[mp.target_git_repository_link].append(mp)
+
+    repos = []
+    for repo_link, (repo, b, max_age) in repos_by_link.items():
+        get_mps(repo, b, max_age, output_directory,
+                mps=mps_by_repo[repo_link], index=index,
+                lp=lp if git_head_source == 'launchpad' else None)
+        if repo.pull_request_count > 0:
+            repos.append(repo)
+        print(repo)
+    return repos
+
+
+def get_lp_repos_for_owner(lp, collected, owner, max_age=None,
+                           output_directory=None, collection='repo',
+                           index=None, git_head_source='clone'):
+    '''Return all lp-git repos and mps for the given owner with the age limit.
+
+    Rather than enumerating every repository of the owner, the owner's open
+    merge proposals are requested by status in a single collection and then
+    grouped by their target repository. Repositories whose self_link is
+    already in collected are skipped, and the ones found are added to it.'''
+    person = lp.people[owner]
+    if collection == 'target':
+        mps = get_target_mps(lp, person)
+    else:
+        mps = person.getMergeProposals(status=LP_CANDIDATE_STATUSES)
+    mps_by_repo = defaultdict(list)
+    for mp in mps:
+        target_link = mp.target_git_repository_link
+        # Skip bzr merge proposals and repos collected from the config
+        if target_link is None or target_link in collected:
+            continue
+        if collection == 'target' and (index is None or
+                                       mp.web_link not in index):
+            mp = prefetch_mp(lp, mp)
+        mps_by_repo[target_link].append(mp)
+
+    repos = []
+    for target_link, repo_mps in mps_by_repo.items():
+        b = repo_mps[0].target_git_repository
+        repo = LaunchpadRepo(b, b.web_link, b.display_name)
+        get_mps(repo, b, max_age, output_directory, mps=repo_mps,
+                index=index,
+                lp=lp if git_head_source == 'launchpad' else None)
+        collected.add(target_link)
+        if repo.pull_request_count > 0:
+            repos.append(repo)
+        print(repo)
+    return repos
+
+
+def get_repos(sources, github_username, github_password, github_token,
+              index=None, request_timeout=None, known_repos=()):
+    '''Return all repos, prs and reviews for the given github sources.
+
+    Repos of known_repos, already collected, are skipped by the orgs
+    search.'''
+    recorder.install_github()
+    store = recorder.get_store()
+    if isinstance(github_token, str):
+        github_token = (github_token,)
     if github_token:
-        gh = github.Github(github_token)
+        # Several tokens share the requests according to their quotas
+        gh = transport.get_github(tuple(github_token),
+                                  timeout=request_timeout)
     elif github_username and github_password:
-        gh = github.Github(github_username,
-                           github_password)
+        gh = transport.get_github(github_username, github_password,
+                                  timeout=request_timeout)
+    elif store is not None and store.replaying:
+        # Replayed traffic needs no credentials
+        gh = transport.get_github(timeout=request_timeout)
     else:
         print_warning(
                [("You have configured Github repositories but not supplied "
@@ -639,7 +1366,158 @@ def get_repos(sources, github_username, github_password, github_token):
                  "Github repositories.")])
         return []
 
-    repos = get_all_repos(gh, sources['repos'])
+    repos = get_all_repos(gh, sources.get('repos', {}), index)
+    if 'orgs' in sources:
+        collected = {
+            '{}/{}'.format(org.replace(' ', ''), name).lower()
+            for org in sources.get('repos', {})
+            for name in sources['repos'][org]}
+        collected.update(get_known_names(known_repos, 'github'))
+        repos.extend(get_org_repos(gh, sources['orgs'], collected, index))
+    return repos
+
+
+def repo_to_dict(repo):
+    '''Return a JSON serializable snapshot of a repo and its pull requests.'''
+    def isodate(date):
+        return date.isoformat() if isinstance(date, datetime.datetime) else None
+
+    return {
+        'repo_type': repo.repo_type,
+        'url': repo.url,
+        'name': repo.name,
+        'tab_name': repo.tab_name,
+        'tox': repo.tox,
+        'config_key': repo.config_key,
+        'pull_requests': [{
+            'pull_request_type': pr.pull_request_type,
+            'url': pr.url,
+            'title': pr.title,
+            'owner': pr.owner,
+            'state': pr.state,
+            'date': isodate(pr.date),
+            'latest_activity': isodate(pr.latest_activity),
+            'review_count': pr.review_count,
+            'reviews': [{
+                'review_type': review['review_type'],
+                'url': review['url'],
+                'owner': review['owner'],
+                'state': review['state'],
+                'date': isodate(review['date']),
+                'review_before_latest_commit':
+                    review['review_before_latest_commit'],
+            } for review in pr.reviews],
+        } for pr in repo.pull_requests],
+    }
+
+
+def repo_from_dict(data, stale_since=None):
+    '''Return a Repo rebuilt from a repo_to_dict snapshot.'''
+    def parse_date(date):
+        return datetime.datetime.fromisoformat(date) if date else None
+
+    repo = Repo(data['repo_type'], None, data['url'], data['name'],
+                dedicated_tab_name=data['tab_name'])
+    repo.tox = data['tox']
+    repo.stale_since = stale_since
+    if data.get('config_key'):
+        repo.config_key = tuple(data['config_key'])
+    for pr_data in data['pull_requests']:
+        pr = PullRequest(pr_data['pull_request_type'], None, pr_data['url'],
+                         pr_data['title'], pr_data['owner'], pr_data['state'],
+                         parse_date(pr_data['date']),
+                         pr_data['review_count'],
+                         latest_activity=parse_date(
+                             pr_data['latest_activity']))
+        for review_data in pr_data['reviews']:
+            pr.add_review(Review(
+                review_data['review_type'], None, review_data['url'],
+                review_data['owner'], review_data['state'],
+                parse_date(review_data['date']),
+                review_data['review_before_latest_commit']))
+        repo.add(pr)
+    return repo
+
+
+def get_snapshot_filepath(output_directory, source_name):
+    return os.path.join(output_directory, '.snapshots',
+                        '{}.json'.format(source_name))
+
+
+def save_snapshot(output_directory, source_name, repos):
+    '''Save the repos successfully collected for a source.'''
+    snapshot_filepath = get_snapshot_filepath(output_directory, source_name)
+    os.makedirs(os.path.dirname(snapshot_filepath), exist_ok=True)
+    tmp_filepath = '{}.tmp'.format(snapshot_filepath)
+    with open(tmp_filepath, 'w') as snapshot_file:
+        json.dump({'collected_at': NOW.isoformat(),
+                   'repos': [repo_to_dict(repo) for repo in repos]},
+                  snapshot_file)
+    os.replace(tmp_filepath, snapshot_filepath)
+
+
+def load_snapshot(output_directory, source_name):
+    '''Return the repos of the last snapshot of a source, marked stale.'''
+    snapshot_filepath = get_snapshot_filepath(output_directory, source_name)
+    try:
+        with open(snapshot_filepath) as snapshot_file:
+            snapshot = json.load(snapshot_file)
+    except (OSError, ValueError):
+        return []
+    collected_at = datetime.datetime.fromisoformat(snapshot['collected_at'])
+    return [repo_from_dict(repo_data, stale_since=collected_at)
+            for repo_data in snapshot['repos']]
+
+
+def collect_source(source_name, collect, deadline, output_directory,
+                   snapshot=True, index=None):
+    '''Return the repos collected by collect(index) for a source.
+
+    collect runs in a worker thread and is given deadline seconds (None for
+    no limit). When it finishes in time its repos are saved as the source's
+    snapshot. When it fails or exceeds the deadline the repos of the last
+    snapshot are returned instead, marked stale, so the sweep still finishes
+    in bounded time and the report is always published. With snapshot False,
+    e.g. when collecting only part of a source, no snapshot is saved or
+    used.
+
+    collect is given a fork of index, merged into it only when collect
+    finishes in time, as an abandoned worker keeps running.'''
+    result = {}
+    worker_index = index.fork() if index is not None else None
+
+    def worker():
+        try:
+            result['repos'] = profiling.call(collect, worker_index)
+        except Exception as e:
+            result['error'] = e
+
+    started = time.monotonic()
+    thread = threading.Thread(target=worker, daemon=True,
+                              name='collect-{}'.format(source_name))
+    thread.start()
+    thread.join(deadline)
+    if 'repos' in result:
+        if index is not None:
+            index.merge(worker_index)
+        if snapshot:
+            save_snapshot(output_directory, source_name, result['repos'])
+        print('{} collected in {:.1f}s'.format(
+            source_name, time.monotonic() - started))
+        return result['repos']
+
+    if 'error' in result:
+        reason = 'failed: {!r}'.format(result['error'])
+    else:
+        # The abandoned worker is a daemon thread, and ends when its
+        # requests time out. Meanwhile it still uses the shared clients, so
+        # later sources get clients of their own, and its own index.
+        reason = 'did not finish within {}s'.format(deadline)
+        transport.reset()
+    repos = load_snapshot(output_directory, source_name) if snapshot else []
+    print_warning(
+        ["Collecting {} {}".format(source_name, reason),
+         "Falling back to {} repos from the last snapshot".format(len(repos))])
     return repos
 
 
@@ -649,57 +1527,253 @@ def get_sources(source):
     return data
 
 
-def aggregate_reviews(sources, output_directory, github_password, github_token,
-                      github_username, tox, lp_credentials_store, tox_jobs):
+def get_config_paths(configs):
+    '''Return the config file paths given to --config.
+
+    Directories are replaced by the YAML files they contain.'''
+    paths = []
+    for config in configs:
+        if os.path.isdir(config):
+            paths.extend(sorted(
+                os.path.join(config, filename)
+                for filename in os.listdir(config)
+                if filename.endswith(('.yaml', '.yml'))))
+        else:
+            paths.append(config)
+    return paths
+
+
+def get_teams(configs, output_directory):
+    '''Return a Team for each config file given to --config.
+
+    A team's report is written to the output-directory set in its config.
+    Without one, a single config is written to output_directory, and
+    several to a sub-directory of it named after each config file.'''
+    paths = get_config_paths(configs)
+    if not paths:
+        raise click.UsageError("No config files found in {}".format(
+            ', '.join(configs)))
+    teams = []
+    for path in paths:
+        if path == '-':
+            sources = get_sources(sys.stdin)
+        else:
+            with open(path) as config_file:
+                sources = get_sources(config_file)
+        if not isinstance(sources, dict):
+            raise click.UsageError(
+                "{} is not a review-gator config".format(path))
+        team_directory = sources.get('output-directory')
+        if team_directory is None and len(paths) > 1:
+            team_directory = os.path.join(
+                output_directory,
+                os.path.splitext(os.path.basename(path))[0])
+        teams.append(Team(path, sources, team_directory or output_directory))
+
+    directories = [os.path.abspath(team.output_directory) for team in teams]
+    if len(set(directories)) != len(directories):
+        raise click.UsageError(
+            "Each config must be written to its own output directory")
+    return teams
+
+
+def get_source_entries(sources):
+    '''Return {config key: settings} for each entry of the sources.
+
+    An entry is a github repo or org, an lp-git repo or owner, or a
+    launchpad branch or owner. Keys are tuples like
+    ('github', 'repos', org, name) or ('lp-git', 'owners', owner).'''
+    entries = {}
+    for source_name in ('lp-git', 'launchpad', 'github'):
+        for section, data in (sources.get(source_name) or {}).items():
+            if not isinstance(data, dict):
+                # e.g. a source's deadline
+                continue
+            for name, settings in data.items():
+                if source_name == 'github' and section == 'repos':
+                    for repo_name, repo_settings in (settings or {}).items():
+                        entries[(source_name, section, name, repo_name)] = \
+                            repo_settings
+                else:
+                    entries[(source_name, section, name)] = settings
+    return entries
+
+
+def diff_sources(old_sources, new_sources):
+    '''Return the config keys added to and removed from old_sources.
+
+    An entry whose settings changed is both removed and added.'''
+    old_entries = get_source_entries(old_sources)
+    new_entries = get_source_entries(new_sources)
+    added = {key for key, settings in new_entries.items()
+             if key not in old_entries or old_entries[key] != settings}
+    removed = {key for key, settings in old_entries.items()
+               if key not in new_entries or new_entries[key] != settings}
+    return added, removed
+
+
+def filter_sources(sources, keys):
+    '''Return a copy of sources with only the entries in keys.
+
+    Squads and per-source settings such as deadlines are kept.'''
+    filtered = {key: value for key, value in sources.items()
+                if key not in ('lp-git', 'launchpad', 'github')}
+    for key in keys:
+        source_name, section = key[0], key[1]
+        source = filtered.setdefault(source_name, {
+            setting: value for setting, value
+            in (sources.get(source_name) or {}).items()
+            if not isinstance(value, dict)})
+        section_data = source.setdefault(section, {})
+        if len(key) == 4:
+            section_data.setdefault(key[2], {})[key[3]] = \
+                sources[source_name][section][key[2]][key[3]]
+        else:
+            section_data[key[2]] = sources[source_name][section][key[2]]
+    return filtered
+
+
+def collect_team(team, sources, index, github_password, github_token,
+                 github_username, lp_credentials_store, lp_collection='repo',
+                 source_deadline=None, request_timeout=None, snapshot=True,
+                 git_head_source='clone', known_repos=()):
+    '''Return the repos collected for the given sources of a team.
+
+    known_repos are the repos of the team already collected, which orgs and
+    owners scans do not collect again.'''
+    output_directory = team.output_directory
+    repos = []
+    if 'lp-git' in sources:
+        repos.extend(collect_source(
+            'lp-git',
+            lambda source_index: get_lp_repos(
+                sources['lp-git'], output_directory, lp_credentials_store,
+                lp_collection, source_index, request_timeout,
+                git_head_source, known_repos),
+            sources['lp-git'].get('deadline', source_deadline),
+            output_directory, snapshot, index))
+    if 'launchpad' in sources:
+        repos.extend(collect_source(
+            'launchpad',
+            lambda source_index: get_branches(
+                sources['launchpad'], lp_credentials_store, source_index,
+                request_timeout, known_repos),
+            sources['launchpad'].get('deadline', source_deadline),
+            output_directory, snapshot, index))
+    if 'github' in sources:
+        repos.extend(collect_source(
+            'github',
+            lambda source_index: get_repos(
+                sources['github'], github_username, github_password,
+                github_token, source_index, request_timeout, known_repos),
+            sources['github'].get('deadline', source_deadline),
+            output_directory, snapshot, index))
+    return repos
+
+
+def aggregate_reviews(teams, github_password, github_token, github_username,
+                      tox, lp_credentials_store, tox_jobs,
+                      lp_collection='repo', source_deadline=None,
+                      request_timeout=None, partial_sources=None,
+                      git_head_source='clone'):
+    '''Collect the sources of the teams, render their reports and run tox.
+
+    The teams share one CollectionIndex, so a repository or pull request in
+    several teams' configs is only fetched and processed once, and tox runs
+    once per merge proposal. The repos of each team are kept in team.repos.
+    If partial_sources is given, as {team: sources}, only part of those
+    teams' configs is collected: the new repos are added to the already
+    collected ones, only those teams are rendered, and no source snapshots
+    are saved.'''
+    snapshot = partial_sources is None
+    if partial_sources is None:
+        partial_sources = {team: team.sources for team in teams}
     try:
-        # Extract squad definitions from config (optional)
-        squads = sources.get('squads', {})
-
-        repos = []
-        if 'lp-git' in sources:
-            repos.extend(get_lp_repos(sources['lp-git'], output_directory,
-                                      lp_credentials_store))
-        if 'launchpad' in sources:
-            # install time dependency on launchpad libs.
-            from . import launchpadagent
-            repos.extend(get_branches(sources['launchpad'],
-                                      lp_credentials_store))
-        if 'github' in sources:
-            repos.extend(get_repos(sources['github'],
-                                   github_username, github_password, github_token))
+        index = CollectionIndex()
+        new_repos = {}
+        for team, sources in partial_sources.items():
+            new_repos[team] = collect_team(
+                team, sources, index, github_password, github_token,
+                github_username, lp_credentials_store, lp_collection,
+                source_deadline, request_timeout, snapshot, git_head_source,
+                () if snapshot else team.repos)
+            if snapshot:
+                team.repos = new_repos[team]
+            else:
+                # A repo now listed under repos replaces the one an orgs or
+                # owners scan collected before
+                new_urls = {repo.url for repo in new_repos[team]}
+                team.repos = [repo for repo in team.repos
+                              if repo.url not in new_urls] + new_repos[team]
+        print('collected {} pull requests, skipped {} duplicates'.format(
+            len(index.pull_requests), index.duplicates))
+        # lpcache is only imported once a Launchpad client was created
+        lpcache = sys.modules.get('{}.lpcache'.format(__package__))
+        if lpcache is not None:
+            print(lpcache.report())
+        # ghpool is only imported once several Github tokens were given
+        ghpool = sys.modules.get('{}.ghpool'.format(__package__))
+        if ghpool is not None:
+            print(ghpool.report())
         # Should we be running tox on any pull requests?
         if tox:
-            # Are there any repos with any pull requests requiring a tox run?
-            tox_repos = [repo for repo in repos if getattr(repo, 'pull_request_requiring_tox_count', 0) > 0]
+            # deferred import of the tox machinery until required
+            from joblib import Parallel, delayed
+            from lpshipit import _format_git_branch_name
+            from . import tox_runner
+
+            # Every pull request requiring a tox run, as (merge proposal,
+            # environment, output directory, parallel tox) tuples. A merge
+            # proposal shown by several teams runs in the output directory
+            # of the first.
             tox_mps = []
-
-            for tox_repo in tox_repos:
-                tox_mps.extend(tox_repo.pull_requests_requiring_tox)
+            tox_directories = {}
+            for team, repos in new_repos.items():
+                for repo in repos:
+                    for tox_mp, environment in repo.pull_requests_requiring_tox:
+                        mp_id = tox_mp.web_link.split('/')[-1]
+                        if mp_id in tox_directories:
+                            continue
+                        tox_directories[mp_id] = team.output_directory
+                        tox_mps.append((tox_mp, environment,
+                                        team.output_directory,
+                                        repo.parallel_tox))
+
+            for team in partial_sources:
+                # Drop the tox artifacts of merge proposals no longer shown,
+                # and any beyond the retention limits, before adding new ones
+                team_mp_ids = {pr.mp_id for repo in team.repos if repo.tox
+                               for pr in repo.pull_requests}
+                artifacts.prune(team.output_directory, team_mp_ids,
+                                time.time())
+                # Merge proposals run in another team's output directory are
+                # linked from there
+                for mp_id in team_mp_ids:
+                    directory = tox_directories.get(mp_id)
+                    if directory is not None and \
+                            directory != team.output_directory:
+                        artifacts.link(directory, team.output_directory,
+                                       mp_id)
+            # A merge proposal now run in an output directory that linked
+            # to another's artifacts must not write through those links
+            for mp_id, directory in tox_directories.items():
+                artifacts.remove_links(directory, mp_id)
 
             # For all pull requests requiring a tox run set the initial state
             # as running, then render the report as normal.
             Parallel(n_jobs=tox_jobs)(
                 delayed(tox_runner.prep_tox_state)(
-                    output_directory,
+                    directory,
                     tox_mp.web_link.split('/')[-1])
-                for tox_mp, _environment in tox_mps
+                for tox_mp, _environment, directory, _parallel in tox_mps
             )
 
-        # Render the report
-        render(repos, output_directory, tox, squads)
+        # Render the reports
+        for team in partial_sources:
+            render(team.repos, team.output_directory, tox,
+                   team.sources.get('squads', {}))
 
         if tox:
-            tox_repos_to_run_in_parallel = [tox_repo for tox_repo in tox_repos if tox_repo.parallel_tox]
-            tox_repos_to_run_without_parallelization = [tox_repo for tox_repo in tox_repos if not tox_repo.parallel_tox]
-
-            tox_mps_to_run_in_parallel = []
-            for tox_repo_to_run_in_parallel in tox_repos_to_run_in_parallel:
-                tox_mps_to_run_in_parallel.extend(tox_repo_to_run_in_parallel.pull_requests_requiring_tox)
-
-            tox_mps_to_run_without_parallelization = []
-            for tox_repo_to_run_without_parallelization in tox_repos_to_run_without_parallelization:
-                tox_mps_to_run_without_parallelization.extend(tox_repo_to_run_without_parallelization.pull_requests_requiring_tox)
-
             # Once report is rendered with initial state then we can start
             # running the tox tests and update state after each run
 
@@ -709,11 +1783,13 @@ def aggregate_reviews(sources, output_directory, github_password, github_token,
             # for projects that use jenkins-job-builder
             print("**** Running tox tests without parallelization. "
                   "Repos with `parallel-tox: false` set... ")
-            for tox_mp, environment in tox_mps_to_run_without_parallelization:
+            for tox_mp, environment, directory, parallel in tox_mps:
+                if parallel:
+                    continue
                 tox_runner.run_tox(
                     tox_mp.source_git_repository.display_name,
                     _format_git_branch_name(tox_mp.source_git_path),
-                    output_directory,
+                    directory,
                     tox_mp.web_link.split('/')[-1],
                     parallel_tox=False,
                     environment=environment)
@@ -724,30 +1800,89 @@ def aggregate_reviews(sources, output_directory, github_password, github_token,
                 delayed(tox_runner.run_tox)(
                     tox_mp.source_git_repository.display_name,
                     _format_git_branch_name(tox_mp.source_git_path),
-                    output_directory,
+                    directory,
                     tox_mp.web_link.split('/')[-1],
                     environment=environment)
-                for tox_mp, environment in tox_mps_to_run_in_parallel
+                for tox_mp, environment, directory, parallel in tox_mps
+                if parallel
             )
 
+        from babel.dates import format_datetime
         last_poll = format_datetime(localize_datetime(datetime.datetime.utcnow()))
         print("Last run @ {}".format(last_poll))
-    except socket.timeout as se:
+    except (socket.timeout, TimeoutError) as e:
         print_warning(
-            ("Socket.timeout error querying github/launchpad: %s. "
-              "We will retry. \n".format(str(se))))
-    except TimeoutError as e:
-        print_warning(
-            ("Socket.timeout error querying github/launchpad: %s. "
-              "We will retry. \n".format(str(e))))
+            ["Timeout error querying github/launchpad: {}.".format(str(e)),
+             "We will retry."])
+
+
+def wait_for_poll(poll_deadline, teams):
+    '''Sleep until poll_deadline, or until the config file of a team is
+    modified. Returns the teams whose config was modified, if any.'''
+    while True:
+        remaining = poll_deadline - time.monotonic()
+        if remaining <= 0:
+            return []
+        time.sleep(min(remaining, CONFIG_CHECK_INTERVAL))
+        changed = []
+        for team in teams:
+            if team.config_mtime is None:
+                continue
+            try:
+                mtime = os.stat(team.config_path).st_mtime
+            except OSError:
+                continue
+            if mtime != team.config_mtime:
+                team.config_mtime = mtime
+                changed.append(team)
+        if changed:
+            return changed
+
+
+def reload_sources(teams, tox, collect):
+    '''Apply the changed config files of teams to their collected repos.
+
+    Only the entries added to a config are collected, by calling
+    collect({team: partial sources}), and the repos of removed entries are
+    dropped. If only the squads changed the report is re-rendered without
+    fetching anything. A config that cannot be loaded is left as it was.'''
+    partial_sources = {}
+    for team in teams:
+        try:
+            with open(team.config_path) as config_file:
+                new_sources = get_sources(config_file)
+        except (OSError, yaml.YAMLError) as e:
+            print_warning(["Could not reload {}".format(team.config_path),
+                           str(e)])
+            continue
+        if not isinstance(new_sources, dict):
+            print_warning(["Could not reload {}".format(team.config_path)])
+            continue
+
+        old_sources, team.sources = team.sources, new_sources
+        added, removed = diff_sources(old_sources, new_sources)
+        print("**** {} changed: {} entries added, {} removed ****".format(
+            team.config_path, len(added), len(removed)))
+        team.repos = [repo for repo in team.repos
+                      if repo.config_key not in removed]
+        if added:
+            partial_sources[team] = filter_sources(new_sources, added)
+        elif removed or new_sources.get('squads') != old_sources.get('squads'):
+            render(team.repos, team.output_directory, tox,
+                   new_sources.get('squads', {}))
+    if partial_sources:
+        collect(partial_sources)
 
 
 @click.command()
 @click.option('--config-skeleton', is_flag=True, default=False,
               help='Print example config.')
-@click.option('--config', required=True, type=click.File('r'),
+@click.option('--config', required=True, multiple=True,
+              type=click.Path(exists=True, allow_dash=True),
               help="Config yaml specifying which repositories/branches to "
-                   "query.{}".format(" When using the review-gator snap this"
+                   "query. Repeat it, or give a directory of configs, to "
+                   "collect several teams' configs at once, each written to "
+                   "its own output directory.{}".format(" When using the review-gator snap this"
                                      " config must reside under $HOME."
                                      if os.environ.get('SNAP', None) else ""),
               cls=clicklib.NotRequiredIf,
@@ -772,10 +1907,13 @@ def aggregate_reviews(sources, output_directory, github_password, github_token,
                    "You can also set GITHUB_PASSWORD as an environment "
                    "variable.", default=None)
 @click.option('--github-token', envvar='GITHUB_TOKEN', required=False,
+              multiple=True,
               help="Your github api token. If you provide this then you do not"
                    "need to provide username and password. "
                    "You can also set GITHUB_TOKEN as an environment "
-                   "variable.", default=None)
+                   "variable. Repeat it, or separate the tokens in "
+                   "GITHUB_TOKEN by spaces, to share the requests between "
+                   "several tokens.")
 @click.option('--poll', is_flag=True, default=False,
               help='Keep aggregating reviews at a specified interval')
 @click.option('--tox', is_flag=True, default=False,
@@ -797,9 +1935,80 @@ def aggregate_reviews(sources, output_directory, github_password, github_token,
                         'If running as a strictly confined snap running tox will not work due to external '
                         'processes being called during source repo cloning and during tox running.'
                         if os.environ.get('SNAP', None) else ''))
+@click.option('--tox-artifact-max-age', type=click.IntRange(1),
+              required=False, default=artifacts.DEFAULT_MAX_AGE_DAYS,
+              help="Days tox badges, summaries and outputs are kept "
+                   "[default: {}]".format(artifacts.DEFAULT_MAX_AGE_DAYS))
+@click.option('--tox-artifact-max-size', type=click.IntRange(1),
+              required=False, default=artifacts.DEFAULT_MAX_TOTAL_MB,
+              help="Megabytes of tox artifacts kept in the output directory, "
+                   "the oldest full tox outputs are removed beyond it "
+                   "[default: {}]".format(artifacts.DEFAULT_MAX_TOTAL_MB))
+@click.option('--source-deadline', type=float, required=False, default=None,
+              help="Seconds each source (lp-git, launchpad, github) may take "
+                   "to collect before its last snapshot is used instead. A "
+                   "'deadline' key in a source's config overrides this. "
+                   "[default: no deadline]")
+@click.option('--request-timeout', type=float, required=False, default=60,
+              help="Timeout in seconds for each Github or Launchpad request "
+                   "[default: 60 seconds]")
+@click.option('--per-page', type=click.IntRange(1, transport.GITHUB_MAX_PER_PAGE),
+              required=False, default=transport.DEFAULT_PER_PAGE,
+              help="Number of items requested per page from Github "
+                   "[default: {}]".format(transport.DEFAULT_PER_PAGE))
+@click.option('--http-retries', type=click.IntRange(0), required=False,
+              default=transport.DEFAULT_RETRIES,
+              help="Number of times a Github or Launchpad request is retried, "
+                   "with jittered backoff, after a 5xx response or a "
+                   "connection reset [default: {}]".format(
+                        transport.DEFAULT_RETRIES))
+@click.option('--lp-cache-max-size', type=click.IntRange(1), required=False,
+              default=transport.DEFAULT_LP_CACHE_MAX_SIZE_MB,
+              help="Megabytes of Launchpad responses kept in the launchpadlib "
+                   "cache, the least recently used are removed beyond it "
+                   "[default: {}]".format(
+                        transport.DEFAULT_LP_CACHE_MAX_SIZE_MB))
+@click.option('--lp-cache-max-age', type=click.IntRange(1), required=False,
+              default=transport.DEFAULT_LP_CACHE_MAX_AGE_DAYS,
+              help="Days Launchpad responses are kept in the launchpadlib "
+                   "cache [default: {}]".format(
+                        transport.DEFAULT_LP_CACHE_MAX_AGE_DAYS))
+@click.option('--lp-collection', type=click.Choice(LP_COLLECTION_STRATEGIES),
+              required=False, default='repo',
+              help="How lp-git merge proposals are collected. 'repo' queries "
+                   "each repository, 'target' queries each project or owner "
+                   "once in large pages and prefetches comments and votes "
+                   "[default: repo].")
+@click.option('--git-head-source', type=click.Choice(GIT_HEAD_SOURCES),
+              required=False, default='clone',
+              help="How the latest commit of lp-git source branches, used to "
+                   "flag reviews made before it, is found. 'clone' clones "
+                   "each branch, 'launchpad' reads its repository's refs "
+                   "through the Launchpad API without git "
+                   "[default: clone].")
+@click.option('--profile', is_flag=True, default=False,
+              help="Profile the first run and write profile.pstats and "
+                   "profile-summary.txt, the time spent collecting, "
+                   "rendering and running tox, to the output directory "
+                   "(the parent output directory with several configs).")
+@click.option('--record', type=click.Path(file_okay=False), required=False,
+              default=None,
+              help="Record all Github, Launchpad and git clone responses to "
+                   "this directory for later use with --replay.")
+@click.option('--replay', type=click.Path(exists=True, file_okay=False),
+              required=False, default=None,
+              help="Run without network access from responses previously "
+                   "saved with --record to this directory.")
+@click.option('--replay-latency', type=float, required=False, default=0,
+              help="Milliseconds of latency to inject before each replayed "
+                   "response [default: 0].")
 def main(config_skeleton, config, output_directory,
          github_username, github_password, github_token, poll,
-         tox, poll_interval, lp_credentials_store, tox_jobs):
+         tox, poll_interval, lp_credentials_store, tox_jobs,
+         tox_artifact_max_age, tox_artifact_max_size, source_deadline,
+         request_timeout, per_page, http_retries, lp_cache_max_size,
+         lp_cache_max_age, lp_collection, git_head_source, profile, record,
+         replay, replay_latency):
     """Start here."""
     global NOW
     if config_skeleton:
@@ -812,12 +2021,46 @@ def main(config_skeleton, config, output_directory,
             print(output)
             exit(0)
 
-    sources = get_sources(config)
-    aggregate_reviews(sources, output_directory, github_password,
-                      github_token, github_username, tox,
-                      lp_credentials_store, tox_jobs)
+    transport.configure(per_page=per_page, retries=http_retries,
+                        lp_cache_max_size=lp_cache_max_size,
+                        lp_cache_max_age=lp_cache_max_age)
+    artifacts.configure(max_age_days=tox_artifact_max_age,
+                        max_total_mb=tox_artifact_max_size)
+
+    if record and replay:
+        raise click.UsageError(
+            "Illegal usage: `record` is mutually exclusive with `replay`.")
+    if record:
+        os.makedirs(record, exist_ok=True)
+        recorder.install(record, now=NOW)
+    elif replay:
+        store = recorder.install(replay, replaying=True,
+                                 latency=replay_latency / 1000.0)
+        # Replay as of the time of recording so that age cutoffs and the
+        # requests derived from them match the recording
+        if store.now is not None:
+            NOW = store.now
+
+    def collect(partial_sources=None):
+        aggregate_reviews(teams, github_password, github_token,
+                          github_username, tox, lp_credentials_store,
+                          tox_jobs, lp_collection, source_deadline,
+                          request_timeout, partial_sources, git_head_source)
+
+    if not config:
+        raise click.MissingParameter(param_type='option',
+                                     param_hint="'--config'")
+    teams = get_teams(config, output_directory)
+    if profile:
+        # One profile covers every team, written next to the reviews of a
+        # single team and to the parent output directory of several
+        profiling.run(collect, teams[0].output_directory
+                      if len(teams) == 1 else output_directory)
+    else:
+        collect()
 
     if poll:
+        from babel.dates import format_datetime
         # We do use time.sleep which is blocking so it is best to 'nice'
         # the process to reduce CPU usage. https://linux.die.net/man/1/nice
         os.nice(19)
@@ -827,11 +2070,16 @@ def main(config_skeleton, config, output_directory,
                             datetime.datetime.utcnow() +
                             datetime.timedelta(seconds=poll_interval)))
             print("Next run @ {}".format(next_poll))
-            time.sleep(poll_interval)  # wait before checking again
+            poll_deadline = time.monotonic() + poll_interval
+            # wait before checking again, applying config changes meanwhile
+            while True:
+                changed_teams = wait_for_poll(poll_deadline, teams)
+                if not changed_teams:
+                    break
+                NOW = localize_datetime(datetime.datetime.utcnow())
+                reload_sources(changed_teams, tox, collect)
             NOW = localize_datetime(datetime.datetime.utcnow())
-            aggregate_reviews(sources, output_directory, github_password,
-                              github_token, github_username, tox,
-                              lp_credentials_store)
+            collect()
 
 
 if __name__ == '__main__':
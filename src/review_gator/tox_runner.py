@@ -1,37 +1,102 @@
 #!/usr/bin/env python
 
+import datetime
 import os
+import re
 import shutil
+import threading
+import time
 
 import git
 from lpmptox import runtox as lpmptox_runtox
 
+from . import artifacts
+
+# Seconds between updates of the status of a running tox
+STATUS_INTERVAL = 2
+# Lines of tox 3 and tox 4 output starting work on a tox environment
+TOX_ENV_RE = re.compile(
+    r'^(?P<env>[\w.-]+)'
+    r'(?: (?:create|recreate|installdeps|inst|develop-inst|run-test-pre|'
+    r'run-test)\b|: (?:commands\[\d+\]|install_deps|install_package|'
+    r'recreate))')
+
+
+def get_tox_status(state, started=None):
+    return {
+        'state': state,
+        'started': started.isoformat() if started else None,
+        'elapsed': 0,
+        'env': None,
+        'lines': 0,
+        'exit_code': None,
+    }
+
+
+def follow_tox_output(tox_output, output_directory, mp_id, status, stop):
+    '''Update the status of a running tox from its output until stop is set.
+
+    lpmptox writes the tox output line by line, so every STATUS_INTERVAL
+    seconds the lines added since are read to find the tox environment being
+    run.'''
+    started = time.monotonic()
+    offset = 0
+    partial = b''
+    while not stop.wait(STATUS_INTERVAL):
+        try:
+            with open(tox_output, 'rb') as output_file:
+                output_file.seek(offset)
+                chunk = output_file.read()
+                offset = output_file.tell()
+        except OSError:
+            continue
+        lines = (partial + chunk).split(b'\n')
+        partial = lines.pop()
+        for line in lines:
+            match = TOX_ENV_RE.match(line.decode('utf-8', 'replace'))
+            if match:
+                status['env'] = match.group('env')
+        status['lines'] += len(lines)
+        status['elapsed'] = round(time.monotonic() - started)
+        artifacts.write_status(output_directory, mp_id, status)
+
 
 def prep_tox_state(output_directory=None, mp_id=None):
     os.makedirs(output_directory, exist_ok=True)
     abs_vendor_path = os.path.join(os.path.dirname(
         os.path.realpath(__file__)), "vendor")
-    tox_state = os.path.join(output_directory, "{}.svg".format(mp_id))
-    tox_output = os.path.join(output_directory, "tox-{}.output.txt"
-                              .format(mp_id))
+    tox_state = artifacts.get_badge_filepath(output_directory, mp_id)
+    tox_output = artifacts.get_output_filepath(output_directory, mp_id)
+    tox_summary = artifacts.get_summary_filepath(output_directory, mp_id)
     clock_svg = os.path.join(abs_vendor_path, "clock.svg")
     tox_output_dummy = os.path.join(abs_vendor_path, "tox-output.txt")
     shutil.copy(clock_svg, tox_state)
     shutil.copy(tox_output_dummy, tox_output)
+    shutil.copy(tox_output_dummy, tox_summary)
+    artifacts.write_status(output_directory, mp_id, get_tox_status('queued'))
 
 
 def run_tox(source_repo, source_branch, output_directory=None, mp_id=None,
             parallel_tox=True, environment=None):
     abs_vendor_path = os.path.join(os.path.dirname(
         os.path.realpath(__file__)), "vendor")
-    tox_state = os.path.join(output_directory, "{}.svg".format(mp_id))
-    tox_output = os.path.join(output_directory, "tox-{}.output.txt"
-                              .format(mp_id))
+    tox_state = artifacts.get_badge_filepath(output_directory, mp_id)
+    tox_output = artifacts.get_output_filepath(output_directory, mp_id)
     clock_svg = os.path.join(abs_vendor_path, "clock.svg")
     error_svg = os.path.join(abs_vendor_path, "error.svg")
     success_svg = os.path.join(abs_vendor_path, "success.svg")
     shutil.copy(clock_svg, tox_state)
 
+    started = time.monotonic()
+    status = get_tox_status(
+        'running', datetime.datetime.now(datetime.timezone.utc))
+    artifacts.write_status(output_directory, mp_id, status)
+    stop = threading.Event()
+    follower = threading.Thread(
+        target=follow_tox_output,
+        args=(tox_output, output_directory, mp_id, status, stop),
+        daemon=True)
+    follower.start()
     try:
         tox_return_code = lpmptox_runtox(
             source_repo,
@@ -48,9 +113,18 @@ def run_tox(source_repo, source_branch, output_directory=None, mp_id=None,
               "{} branch {} **".format(source_repo, source_branch))
         print(git_exc)
         tox_return_code = 1
+    finally:
+        stop.set()
+        follower.join()
     if tox_return_code == 0:
         print("PASS for repo {} branch {}".format(source_repo, source_branch))
         shutil.copy(success_svg, tox_state)
     else:
         print("FAIL for repo {} branch {}".format(source_repo, source_branch))
         shutil.copy(error_svg, tox_state)
+    # Keep a short summary and only the compressed full output
+    artifacts.finish(output_directory, mp_id, tox_return_code)
+    status.update(state='passed' if tox_return_code == 0 else 'failed',
+                  elapsed=round(time.monotonic() - started),
+                  exit_code=tox_return_code)
+    artifacts.write_status(output_directory, mp_id, status)
@@ -0,0 +1,153 @@
+"""
+Shared HTTP transport for the Github and Launchpad clients.
+
+Clients are created once with the configured page size, connection pool,
+retry policy and response cache limits and then reused by every collector,
+and by every sweep in --poll mode, so TLS connections are kept alive and
+each backend only logs in once.
+"""
+
+import random
+import time
+
+# Github refuses pages larger than this
+GITHUB_MAX_PER_PAGE = 100
+DEFAULT_PER_PAGE = GITHUB_MAX_PER_PAGE
+DEFAULT_RETRIES = 3
+DEFAULT_POOL_SIZE = 10
+RETRY_STATUSES = (500, 502, 503, 504)
+# Seconds, the retry backoff is jittered between 0 and base * 2^attempt
+RETRY_BACKOFF_BASE = 1.0
+RETRY_BACKOFF_MAX = 30.0
+DEFAULT_LP_CACHE_MAX_SIZE_MB = 100
+DEFAULT_LP_CACHE_MAX_AGE_DAYS = 7
+
+_settings = {
+    'per_page': DEFAULT_PER_PAGE,
+    'retries': DEFAULT_RETRIES,
+    'pool_size': DEFAULT_POOL_SIZE,
+    'lp_cache_max_size': DEFAULT_LP_CACHE_MAX_SIZE_MB,
+    'lp_cache_max_age': DEFAULT_LP_CACHE_MAX_AGE_DAYS,
+}
+_github_clients = {}
+_launchpad_clients = {}
+
+
+def configure(per_page=None, retries=None, pool_size=None,
+              lp_cache_max_size=None, lp_cache_max_age=None):
+    '''Set the transport settings used by clients created from now on.
+
+    The Launchpad response cache is limited to lp_cache_max_size megabytes
+    and lp_cache_max_age days.'''
+    if per_page is not None:
+        _settings['per_page'] = max(1, min(per_page, GITHUB_MAX_PER_PAGE))
+    if retries is not None:
+        _settings['retries'] = retries
+    if pool_size is not None:
+        _settings['pool_size'] = pool_size
+    if lp_cache_max_size is not None:
+        _settings['lp_cache_max_size'] = lp_cache_max_size
+    if lp_cache_max_age is not None:
+        _settings['lp_cache_max_age'] = lp_cache_max_age
+    reset()
+
+
+def reset():
+    '''Forget all clients so that the next ones are created afresh.'''
+    _github_clients.clear()
+    _launchpad_clients.clear()
+
+
+def get_backoff(attempt):
+    return random.uniform(
+        0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** attempt))
+
+
+def get_github(login_or_token=None, password=None, timeout=None):
+    '''Return the shared Github client for the given credentials.
+
+    login_or_token may also be a tuple of tokens, whose quotas are then
+    shared by the client's requests through a ghpool.TokenPool.'''
+    if isinstance(login_or_token, tuple) and len(login_or_token) == 1:
+        login_or_token = login_or_token[0]
+    key = (login_or_token, password, timeout)
+    if key not in _github_clients:
+        # deferred import of PyGithub until required
+        import github
+        if isinstance(login_or_token, tuple):
+            # deferred import of ghpool until required
+            from . import ghpool
+            auth = ghpool.TokenPool(login_or_token)
+            # Rate limited requests are issued again with another token
+            # of the pool rather than waited out
+            retry_class = ghpool.PoolRetry
+            credentials = []
+        else:
+            auth = None
+            # GithubRetry also waits out rate limited 403 responses, which
+            # the search API answers often
+            retry_class = github.GithubRetry
+            credentials = [credential
+                           for credential in (login_or_token, password)
+                           if credential]
+        retry = retry_class(total=_settings['retries'],
+                            backoff_factor=RETRY_BACKOFF_BASE,
+                            backoff_max=RETRY_BACKOFF_MAX,
+                            backoff_jitter=RETRY_BACKOFF_BASE,
+                            status_forcelist=list(RETRY_STATUSES),
+                            raise_on_status=False)
+        kwargs = {
+            'per_page': _settings['per_page'],
+            'retry': retry,
+            'pool_size': _settings['pool_size'],
+        }
+        if timeout:
+            kwargs['timeout'] = timeout
+        if auth is not None:
+            kwargs['auth'] = auth
+        _github_clients[key] = github.Github(*credentials, **kwargs)
+    return _github_clients[key]
+
+
+def get_launchpad(launchpadlib_dir=None, lp_credentials_store=None,
+                  timeout=None):
+    '''Return the shared, logged in, Launchpad client.'''
+    key = (launchpadlib_dir, lp_credentials_store, timeout)
+    if key not in _launchpad_clients:
+        # deferred import of launchpadagent until required
+        from . import launchpadagent
+        lp = launchpadagent.get_launchpad(
+            launchpadlib_dir=launchpadlib_dir,
+            lp_credentials_store=lp_credentials_store,
+            timeout=timeout)
+        install_launchpad_retries(lp, _settings['retries'])
+        # deferred import of lpcache, and so lazr, until required
+        from . import lpcache
+        lpcache.install(lp, _settings['lp_cache_max_size'],
+                        _settings['lp_cache_max_age'])
+        _launchpad_clients[key] = lp
+    return _launchpad_clients[key]
+
+
+def install_launchpad_retries(lp, retries):
+    '''Retry Launchpad requests on 5xx responses and connection resets.
+
+    launchpadlib only retries 502 and 503 responses with a fixed backoff,
+    this replaces that with RETRY_STATUSES and a jittered backoff.'''
+    browser = lp._browser
+    request = browser._connection.request
+
+    def request_and_retry(url, method, body, headers):
+        for attempt in range(retries + 1):
+            try:
+                response, content = request(
+                    url, method=method, body=body, headers=headers)
+            except ConnectionError:
+                if attempt == retries:
+                    raise
+            else:
+                if response.status not in RETRY_STATUSES or attempt == retries:
+                    return response, content
+            time.sleep(get_backoff(attempt))
+
+    browser._request_and_retry = request_and_retry